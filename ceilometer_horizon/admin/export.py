@@ -0,0 +1,274 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Chart rendering. Exports of charts drawn by the browser are rendered to
+PDF in a process pool, off the request path.
+A job is identified by the hash of its SVG, so identical charts are
+rendered once. The state of each job and the rendered PDFs are kept in
+the Django cache so any web process can answer for them; each process
+also keeps the PDFs it rendered in memory, bounded by
+CEILOMETER_EXPORT_CACHE_SIZE bytes, the least recently used going first.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from StringIO import StringIO
+import xml.dom.minidom
+from xml.etree import cElementTree
+
+from django.conf import settings
+from django.core.cache import cache
+
+from svglib.svglib import SvgRenderer
+from reportlab.lib import colors
+from reportlab.graphics import renderPDF, renderSVG
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.shapes import Drawing, String
+try:
+    from reportlab.graphics import renderPM
+except ImportError:
+    # PNG rendering needs the optional _renderPM extension.
+    renderPM = None
+
+LOG = logging.getLogger(__name__)
+
+PDF_CACHE_KEY = "ceilometer_export:%s"
+STATE_CACHE_KEY = "ceilometer_export_state:%s"
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+_pool = None
+_pdfs = OrderedDict()
+_pdfs_size = [0]
+_lock = threading.Lock()
+
+
+def render_pdf(data):
+    """Render an SVG document to a PDF document."""
+    doc = xml.dom.minidom.parseString(data)
+    svg = doc.documentElement
+    svgRenderer = SvgRenderer()
+    svgRenderer.render(svg)
+    drawing = svgRenderer.finish()
+    return renderPDF.drawToString(drawing)
+
+
+def _draw_png(drawing):
+    return renderPM.drawToString(drawing, fmt='PNG')
+
+
+# Content type and renderer of each chart format.
+CHART_FORMATS = {
+    'pdf': ('application/pdf', renderPDF.drawToString),
+    'svg': ('image/svg+xml', renderSVG.drawToString),
+}
+if renderPM is not None:
+    CHART_FORMATS['png'] = ('image/png', _draw_png)
+
+
+def _format_tick(seconds):
+    return time.strftime('%m-%d %H:%M', time.gmtime(seconds))
+
+
+def render_chart(series, title, chart_format, width=800, height=400):
+    """
+    Draw a timeseries.Series as a line chart in one of CHART_FORMATS,
+    return the content type and the rendered chart.
+    """
+    drawing = Drawing(width, height)
+    plot = LinePlot()
+    plot.x = 60
+    plot.y = 50
+    plot.width = width - 90
+    plot.height = height - 100
+    points = list(zip(series.timestamps, series.values))
+    if len(points) < 2:
+        # the axes need a range
+        points = [(0, 0), (1, 0)]
+    plot.data = [points]
+    plot.lines[0].strokeColor = colors.blue
+    plot.lines[0].strokeWidth = 1.5
+    plot.xValueAxis.labelTextFormat = _format_tick
+    drawing.add(plot)
+    drawing.add(String(width / 2, height - 25, title, fontSize=14,
+                       textAnchor='middle'))
+
+    content_type, draw = CHART_FORMATS[chart_format]
+    return content_type, draw(drawing)
+
+
+def max_svg_bytes():
+    return getattr(settings, 'CEILOMETER_EXPORT_MAX_SVG_BYTES',
+                   10 * 1024 * 1024)
+
+
+def validate(data):
+    """
+    Check an SVG document within CEILOMETER_EXPORT_MAX_SVG_BYTES bytes
+    and CEILOMETER_EXPORT_MAX_SVG_ELEMENTS elements before it is loaded
+    in a DOM. The document is read incrementally, each element being
+    dropped once counted. Raises ValueError otherwise.
+    """
+    if len(data) > max_svg_bytes():
+        raise ValueError('SVG larger than %d bytes' % max_svg_bytes())
+    if '<!ENTITY' in data:
+        # entity expansion could grow the document without bounds
+        raise ValueError('SVG entity declarations are not supported')
+
+    max_elements = getattr(settings, 'CEILOMETER_EXPORT_MAX_SVG_ELEMENTS',
+                           100000)
+    elements = 0
+    try:
+        for _, element in cElementTree.iterparse(StringIO(data)):
+            elements += 1
+            if elements > max_elements:
+                raise ValueError('SVG of more than %d elements'
+                                 % max_elements)
+            element.clear()
+    except SyntaxError as e:
+        raise ValueError('invalid SVG: %s' % e)
+
+
+def job_id(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _render(data):
+    # runs in the pool: errors are returned, Pool.apply_async has no
+    # error callback
+    try:
+        return True, render_pdf(data)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def _cache_ttl():
+    return getattr(settings, 'CEILOMETER_EXPORT_CACHE_TTL', 3600)
+
+
+def _set_state(job, state):
+    # the time of the change tells when a pending job is given up
+    cache.set(STATE_CACHE_KEY % job, (state, time.time()), _cache_ttl())
+
+
+def _state(job):
+    """
+    State of a job in the Django cache. A job pending for more than
+    CEILOMETER_EXPORT_TIMEOUT seconds is FAILED: its worker died or its
+    callback was lost with its web process.
+    """
+    entry = cache.get(STATE_CACHE_KEY % job)
+    if entry is None:
+        return None
+    state, changed = entry
+    timeout = getattr(settings, 'CEILOMETER_EXPORT_TIMEOUT', 300)
+    if state == PENDING and time.time() - changed > timeout:
+        return FAILED
+    return state
+
+
+def _has_pdf(job):
+    with _lock:
+        if job in _pdfs:
+            return True
+    return cache.get(PDF_CACHE_KEY % job) is not None
+
+
+def submit(data):
+    """
+    Queue the rendering of an SVG document, return the job id. The
+    document must have been validated.
+    """
+    job = job_id(data)
+    if _has_pdf(job):
+        return job
+    # only one web process renders a job; a failed one, or a done one
+    # whose PDF is not reachable any more, is rendered again
+    if not cache.add(STATE_CACHE_KEY % job, (PENDING, time.time()),
+                     _cache_ttl()):
+        if _state(job) == PENDING:
+            return job
+        _set_state(job, PENDING)
+    _get_pool().apply_async(_render, (data,),
+                            callback=lambda result: _finish(job, result))
+    return job
+
+
+def _finish(job, result):
+    # called by the pool as soon as the job is done, polled or not
+    ok, pdf = result
+    if not ok:
+        LOG.error('Rendering export %s failed:\n%s' % (job, pdf))
+        _set_state(job, FAILED)
+        return
+    _store(job, pdf)
+    _set_state(job, DONE)
+
+
+def status(job):
+    """
+    PENDING, DONE or FAILED, None for an unknown job. A done job whose
+    PDF is not reachable any more, evicted or too large for the Django
+    cache, is FAILED until it is submitted again.
+    """
+    if _has_pdf(job):
+        return DONE
+    state = _state(job)
+    if state == DONE:
+        return FAILED
+    return state
+
+
+def pdf(job):
+    """The rendered PDF of a job, None when it is not done."""
+    with _lock:
+        if job in _pdfs:
+            # most recently used last
+            _pdfs[job] = _pdfs.pop(job)
+            return _pdfs[job]
+    return cache.get(PDF_CACHE_KEY % job)
+
+
+def _store(job, pdf):
+    cache.set(PDF_CACHE_KEY % job, pdf, _cache_ttl())
+    max_size = getattr(settings, 'CEILOMETER_EXPORT_CACHE_SIZE',
+                       50 * 1024 * 1024)
+    if len(pdf) > max_size:
+        return
+    with _lock:
+        if job in _pdfs:
+            return
+        _pdfs[job] = pdf
+        _pdfs_size[0] += len(pdf)
+        while _pdfs_size[0] > max_size:
+            _, evicted = _pdfs.popitem(last=False)
+            _pdfs_size[0] -= len(evicted)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(
+            getattr(settings, 'CEILOMETER_EXPORT_PROCESSES', 2))
+    return _pool
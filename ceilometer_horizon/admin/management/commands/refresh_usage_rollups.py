@@ -0,0 +1,69 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpRequest
+
+from keystoneclient.v2_0 import client as keystone_client
+from openstack_auth.user import Token, create_user_from_token
+
+from ceilometer_horizon.admin import rollups
+
+
+class Command(BaseCommand):
+    help = ("Precompute the usage shown by the Ceilometer panel. Run it "
+            "periodically with the credentials of an admin user, and set "
+            "CEILOMETER_USAGE_ROLLUPS to True.")
+    option_list = BaseCommand.option_list + (
+        make_option('--os-username', default=os.environ.get('OS_USERNAME'),
+                    help='Admin user name, defaults to env[OS_USERNAME]'),
+        make_option('--os-password', default=os.environ.get('OS_PASSWORD'),
+                    help='Admin password, defaults to env[OS_PASSWORD]'),
+        make_option('--os-tenant-name',
+                    default=os.environ.get('OS_TENANT_NAME'),
+                    help='Admin tenant, defaults to env[OS_TENANT_NAME]'),
+        make_option('--os-auth-url', default=os.environ.get('OS_AUTH_URL'),
+                    help='Keystone URL, defaults to env[OS_AUTH_URL] or '
+                         'OPENSTACK_KEYSTONE_URL'),
+    )
+
+    def handle(self, *args, **options):
+        generation = rollups.refresh(self._admin_request(options))
+        self.stdout.write("Usage rollups generation %s completed\n"
+                          % generation.id)
+
+    # request authenticated as the admin user, as the api calls expect
+    def _admin_request(self, options):
+        auth_url = options['os_auth_url'] or \
+            getattr(settings, 'OPENSTACK_KEYSTONE_URL', None)
+        if not (options['os_username'] and options['os_password'] and
+                options['os_tenant_name'] and auth_url):
+            raise CommandError("Admin credentials are required, see --help")
+
+        client = keystone_client.Client(username=options['os_username'],
+                                        password=options['os_password'],
+                                        tenant_name=options['os_tenant_name'],
+                                        auth_url=auth_url)
+        request = HttpRequest()
+        request.session = {}
+        request.user = create_user_from_token(request,
+                                              Token(client.auth_ref),
+                                              auth_url)
+        return request
@@ -0,0 +1,37 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from django.db import models
+
+
+class UsageGeneration(models.Model):
+    """One run of the refresh_usage_rollups command."""
+    started = models.DateTimeField()
+    completed = models.DateTimeField(null=True, db_index=True)
+
+
+class UsageRollup(models.Model):
+    """
+    Total of a counter for a (project, user, resource) as of a
+    generation.
+    """
+    generation = models.ForeignKey(UsageGeneration, related_name='rollups')
+    counter_name = models.CharField(max_length=255)
+    project_id = models.CharField(max_length=255, null=True)
+    user_id = models.CharField(max_length=255, null=True)
+    resource_id = models.CharField(max_length=255, null=True)
+    resource_name = models.CharField(max_length=255, blank=True, default='')
+    total = models.FloatField()
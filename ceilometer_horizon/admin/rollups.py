@@ -0,0 +1,134 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Usage rollups: the total of each counter per (project, user, resource),
+precomputed by the refresh_usage_rollups command along with the resource
+names so the usage tabs need no Ceilometer call. Each refresh stores a
+new generation and the tabs read the latest completed one.
+"""
+
+import logging
+from datetime import datetime
+
+from django.db import transaction
+
+from ..api import ceilometer
+from .models import UsageGeneration, UsageRollup
+
+LOG = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ('counter_name', 'project_id', 'user_id', 'resource_id',
+                 'total')
+
+
+def latest_generation():
+    """The latest completed UsageGeneration, or None."""
+    generations = UsageGeneration.objects.filter(completed__isnull=False)
+    try:
+        return generations.order_by('-id')[0]
+    except IndexError:
+        return None
+
+
+def latest_usage(request, field_sets):
+    """
+    Return the (generation id, {field set: usage list}) of the latest
+    completed generation, or None when there is none yet.
+    """
+    generation = latest_generation()
+    if generation is None:
+        return None
+    names = set()
+    for fields in field_sets:
+        names.update(f.replace(".", "_") for f in fields)
+    raw_usage = list(generation.rollups.filter(
+        counter_name__in=names).values(*ROLLUP_FIELDS + ('resource_name',)))
+    resource_names = dict((row['resource_id'], row['resource_name'])
+                          for row in raw_usage)
+    return generation.id, ceilometer.usage_tables(request, field_sets,
+                                                  raw_usage, resource_names)
+
+
+def refresh(request):
+    """
+    Store a new generation of rollups, return it.
+
+    Only the counters having samples since the previous generation
+    started are asked to Ceilometer. As the totals are the highest value
+    of each counter, a row becomes the highest of its previous total and
+    of the maximum over that window; rows without new samples are
+    carried over as they are.
+    """
+    previous = latest_generation()
+    generation = UsageGeneration.objects.create(started=datetime.utcnow())
+
+    fields = []
+    for field_set in ceilometer.USAGE_FIELD_SETS:
+        fields.extend(field_set)
+
+    totals = {}
+    query = None
+    if previous is not None:
+        for row in previous.rollups.values(*ROLLUP_FIELDS):
+            totals[_rollup_key(row)] = row['total']
+        query = [{'field': 'timestamp', 'op': 'ge',
+                  'value': previous.started.isoformat(' ')}]
+
+    if ceilometer.groupby_enabled(request, fields[0]):
+        raw_usage = ceilometer._grouped_usage_list(request, fields, query)
+    else:
+        # meters can not be listed by timestamp, everything is
+        # recomputed
+        raw_usage = ceilometer._metered_usage_list(request, fields)
+    changed = 0
+    for row in raw_usage:
+        key = _rollup_key(row)
+        total = row['total'] or 0
+        if key not in totals or total > totals[key]:
+            totals[key] = total
+            changed += 1
+
+    directory = ceilometer.resource_directory(request)
+    with transaction.commit_on_success():
+        UsageRollup.objects.bulk_create(
+            [UsageRollup(generation=generation, counter_name=counter_name,
+                         project_id=project_id, user_id=user_id,
+                         resource_id=resource_id,
+                         resource_name=_resource_name(directory,
+                                                      resource_id),
+                         total=total)
+             for (counter_name, project_id, user_id, resource_id), total
+             in totals.items()])
+        generation.completed = datetime.utcnow()
+        generation.save()
+        # only the generation the tabs may still be reading is kept
+        if previous is not None:
+            UsageGeneration.objects.filter(id__lt=previous.id).delete()
+    LOG.info('Usage rollups generation %s: %d rows, %d changed'
+             % (generation.id, len(totals), changed))
+    return generation
+
+
+def _resource_name(directory, resource_id):
+    # longer names are truncated to the column
+    name = directory.get(resource_id, ("",))[0] or ''
+    return name[:UsageRollup._meta.get_field('resource_name').max_length]
+
+
+def _rollup_key(row):
+    return (row['counter_name'], row['project_id'], row['user_id'],
+            row['resource_id'])
@@ -16,343 +16,246 @@
 # under the License.
 
 import logging
-import re
+from urllib import urlencode
 
 from django.utils.translation import ugettext_lazy as _
 
 from horizon import tables
 from horizon.templatetags.sizeformat import filesizeformat, float_format
 
+from ..api import ceilometer
+
 
 LOG = logging.getLogger(__name__)
 
 
-class StringWithPlusOperation(str):
-    """Override "+" operation for string object to make."""
-    def __init__(self, *args, **kwargs):
-        super(StringWithPlusOperation, self).__init__(*args, **kwargs)
-
-    def _split_str(self, string):
-        """
-        Split a string to two parts.
-        The first group is the float number and
-        the second one is a string like unit name.
-        """
-        result = re.search(r'^([-+]?[0-9]*\.?[0-9]+)(.*)$', string)
-        if result:
-            number = float(result.groups()[0])
-            unit = result.groups()[1]
-            return number, unit
-        return None, None
-
-
-    # given a number and units, convert that to bytes
-    def to_bytes(self, number, unit):
-        if unit=="PB":
-            bytes = number * (1024 * 1024 * 1024 * 1024 * 1024)
-        elif unit=="TB":
-            bytes = number * (1024 * 1024 * 1024 * 1024)
-        elif unit=="GB":
-            bytes = number * (1024 * 1024 * 1024)
-        elif unit=="MB":
-            bytes = number * (1024 * 1024)
-        elif unit=="KB":
-            bytes = number * (1024)
-        else:
-            bytes = number
-
-        return bytes
-
-
-    def __radd__(self, another):
-        num_x, unit_x = self._split_str(self)
-        num_y = 0
-        unit_y = ""
-
-        if isinstance(another, (int, float)):
-            num_y = another
-        elif isinstance(another, basestring):
-            num_y, unit_y = self._split_str(another)
-        elif isinstance(another, self.__class__):
-            num_y, unit_y = self._split_str(another.__str__())
-
-        if num_y is None or num_x is None:
-            return '-'
-
-        unit_x = unit_x.strip()
-        unit_y = unit_y.strip()
-
-        if unit_x == unit_y:
-            return "%s%s" % (num_x + num_y, unit_x)
-        else:
-            # convert both units to bytes 
-            converted_num_x = self.to_bytes(num_x, unit_x)
-            converted_num_y = self.to_bytes(num_y, unit_y)
-
-            total = converted_num_x + converted_num_y
-            result = filesizeformat(total, float_format)
-            return result
-
-
-class StringWithPlusOperationForTime(str):
-    """Override "+" operation for string object to make."""
-    def __init__(self, *args, **kwargs):
-        super(StringWithPlusOperationForTime, self).__init__(*args, **kwargs)
-
-    def __radd__(self, another):
-        # convert to seconds, add them and convert again
-        seconds1 = sum(int(x) * 60 ** i for i, x
-                        in enumerate(reversed(self.split(":"))))
-        if isinstance(another, (int, float)):
-            seconds2 = another
-        else:
-            seconds2 = sum(int(x) * 60 ** i for i, x
-                        in enumerate(reversed(another.split(":"))))
-
-        total_time = seconds1 + seconds2
-        converted = "%02d:%02d:%02d" % \
-            reduce(lambda a, b: divmod(a[0], b) + a[1:],
-                   [(total_time,), 60, 60])
-
-        return str(converted)
-
-
-class DiskUsageFilterAction(tables.FilterAction):
-    def filter(self, table, tenants, filter_string):
-        q = filter_string.lower()
-
-        def comp(tenant):
-            if q in tenant.name.lower():
-                return True
-            return False
-
-        return filter(comp, tenants)
-
-
-def get_bytes(field_name=""):
-    def transform(sample):
-        field = getattr(sample, field_name, None)
-        result = filesizeformat(field, float_format)
-        return StringWithPlusOperation(result)
-    return transform
-
-
-class  DiskUsageTable(tables.DataTable):
+def format_bytes(value):
+    return filesizeformat(value, float_format)
+
+
+def get_resource_name(usage):
+    """Display name of the resource of a usage row, or its id."""
+    return usage.get("resource_name") or usage["resource"]
+
+
+def format_cpu_time(nanoseconds):
+    """Format a CPU time in nanoseconds as hh:mm:ss."""
+    seconds = int(nanoseconds) // 1000000000
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                               seconds % 60)
+
+
+class UsageColumn(tables.Column):
+    """
+    Column of a paginated usage table. Its summation is taken from the
+    totals the table got over all the rows of the usage instead of
+    summing the rendered page.
+    """
+    def get_summation(self):
+        totals = getattr(self.table, 'totals', None)
+        if self.summation != "sum" or totals is None:
+            return super(UsageColumn, self).get_summation()
+        summation = self.get_raw_data(totals)
+        for filter_func in self.filters:
+            summation = filter_func(summation)
+        return summation
+
+
+class UsageTable(tables.DataTable):
+    """Base class of the global usage tables."""
+    def get_object_id(self, datum):
+        return ceilometer.usage_id(datum)
+
+    def get_pagination_string(self):
+        # The marker is quoted, resource ids may hold any character.
+        # Keep the tab of this table selected and its filter applied on
+        # the next page.
+        marker = self.get_object_id(self.data[-1])
+        pagination = urlencode({self._meta.pagination_param:
+                                marker.encode("utf-8")})
+        pagination = "%s&tab=ceilometer_overview__%s" % (pagination,
+                                                        self._meta.name)
+        filter_action = self._meta._filter_action
+        if filter_action:
+            param_name = filter_action.get_param_name()
+            filter_string = self.request.POST.get(
+                param_name, self.request.GET.get(param_name, ""))
+            if filter_string.strip():
+                pagination += "&%s" % urlencode(
+                    {param_name: filter_string.strip().encode("utf-8")})
+        return pagination
+
+
+class UsageFilterAction(tables.FilterAction):
+    """
+    Filter of the usage tables. The usage API applies the filter string
+    to all the rows before they are paginated (see UsageTab), so the
+    table data is already filtered.
+    """
+    def filter(self, table, usage, filter_string):
+        return usage
+
+
+class DiskUsageTable(UsageTable):
     tenant = tables.Column("tenant", verbose_name=_("Tenant"), sortable=True)
     user = tables.Column("user", verbose_name=_("User"), sortable=True)
-    instance = tables.Column("resource", verbose_name=_("Resource"), sortable=True)
-    disk_read_bytes = tables.Column(get_bytes("disk_read_bytes"),
-                                    verbose_name=_("Disk Read Bytes"),
-                                    summation="sum",
-                                    sortable=True)
-    disk_read_requests = tables.Column("disk_read_requests",
-                                       verbose_name=_("Disk Read Requests"),
-                                       summation="sum",
-                                       sortable=True)
-    disk_write_bytes = tables.Column(get_bytes("disk_write_bytes"),
-                                     verbose_name=_("Disk Write Bytes"),
+    instance = tables.Column(get_resource_name,
+                             verbose_name=_("Resource"),
+                             sortable=True)
+    disk_read_bytes = UsageColumn("disk_read_bytes",
+                                  verbose_name=_("Disk Read Bytes"),
+                                  filters=(format_bytes,),
+                                  summation="sum",
+                                  sortable=True)
+    disk_read_requests = UsageColumn("disk_read_requests",
+                                     verbose_name=_("Disk Read Requests"),
                                      summation="sum",
                                      sortable=True)
-    disk_write_requests = tables.Column("disk_write_requests",
-                                        verbose_name=_("Disk Write Requests"),
-                                        summation="sum",
-                                        sortable=True)
-    def get_object_id(self, datum):
-        return datum.tenant + datum.user + datum.resource
+    disk_write_bytes = UsageColumn("disk_write_bytes",
+                                   verbose_name=_("Disk Write Bytes"),
+                                   filters=(format_bytes,),
+                                   summation="sum",
+                                   sortable=True)
+    disk_write_requests = UsageColumn("disk_write_requests",
+                                      verbose_name=_("Disk Write Requests"),
+                                      summation="sum",
+                                      sortable=True)
 
     class Meta:
         name = "global_disk_usage"
+        pagination_param = "global_disk_usage_marker"
         verbose_name = _("Global Disk Usage")
-        table_actions = (DiskUsageFilterAction,)
+        table_actions = (UsageFilterAction,)
         multi_select = False
 
 
-class CpuUsageFilterAction(tables.FilterAction):
-    def filter(self, table, tenants, filter_string):
-        q = filter_string.lower()
-
-        def comp(tenant):
-            if q in tenant.name.lower():
-                return True
-            return False
-
-        return filter(comp, tenants)
-
-
-class NetworkTrafficUsageFilterAction(tables.FilterAction):
-    def filter(self, table, tenants, filter_string):
-        q = filter_string.lower()
-
-        def comp(tenant):
-            if q in tenant.name.lower():
-                return True
-            return False
-
-        return filter(comp, tenants)
-
-class NetworkTrafficUsageTable(tables.DataTable):
+class NetworkTrafficUsageTable(UsageTable):
     tenant = tables.Column("tenant", verbose_name=_("Tenant"))
     user = tables.Column("user", verbose_name=_("User"), sortable=True)
-    instance = tables.Column("resource",
+    instance = tables.Column(get_resource_name,
                              verbose_name=_("Resource"),
                              sortable=True)
-    network_incoming_bytes = tables.Column(get_bytes("network_incoming_bytes"),
+    network_incoming_bytes = UsageColumn("network_incoming_bytes",
                                    verbose_name=_("Network incoming Bytes"),
+                                   filters=(format_bytes,),
                                    summation="sum",
                                    sortable=True)
-    network_incoming_packets = tables.Column("network_incoming_packets",
+    network_incoming_packets = UsageColumn("network_incoming_packets",
                             verbose_name=_("Network incoming Packets"),
                             summation="sum", sortable=True)
-    network_outgoing_bytes = tables.Column(get_bytes("network_outgoing_bytes"),
+    network_outgoing_bytes = UsageColumn("network_outgoing_bytes",
                             verbose_name=_("Network Outgoing Bytes"),
+                            filters=(format_bytes,),
                             summation="sum", sortable=True)
-    network_outgoing_packets = tables.Column("network_outgoing_packets",
+    network_outgoing_packets = UsageColumn("network_outgoing_packets",
                             verbose_name=_("Network Outgoing Packets"),
                             summation="sum", sortable=True)
 
-    def get_object_id(self, datum):
-        return datum.tenant + datum.user + datum.resource
-
     class Meta:
         name = "global_network_traffic_usage"
+        pagination_param = "global_network_traffic_usage_marker"
         verbose_name = _("Global Network Traffic Usage")
-        table_actions = (NetworkTrafficUsageFilterAction,)
+        table_actions = (UsageFilterAction,)
         multi_select = False
 
-class NetworkUsageFilterAction(tables.FilterAction):
-    def filter(self, table, tenants, filter_string):
-        q = filter_string.lower()
-
-        def comp(tenant):
-            if q in tenant.name.lower():
-                return True
-            return False
 
-        return filter(comp, tenants)
-
-
-class NetworkUsageTable(tables.DataTable):
+class NetworkUsageTable(UsageTable):
     tenant = tables.Column("tenant", verbose_name=_("Tenant"))
     user = tables.Column("user", verbose_name=_("User"), sortable=True)
-    instance = tables.Column("resource",
+    instance = tables.Column(get_resource_name,
                              verbose_name=_("Resource"),
                              sortable=True)
-    network_duration = tables.Column("network",
+    network_duration = UsageColumn("network",
                                    verbose_name=_("Network Duration"),
                                    summation="sum",
                                    sortable=True)
-    network_creation_requests = tables.Column("network_create",
+    network_creation_requests = UsageColumn("network_create",
                             verbose_name=_("Network Creation Requests"),
                             summation="sum", sortable=True)
-    subnet_duration = tables.Column("subnet",
+    subnet_duration = UsageColumn("subnet",
                             verbose_name=_("Subnet Duration"),
                             summation="sum", sortable=True)
-    subnet_creation = tables.Column("subnet_create",
+    subnet_creation = UsageColumn("subnet_create",
                             verbose_name=_("Subnet Creation Requests"),
                             summation="sum", sortable=True)
-    port_duration = tables.Column("port",
+    port_duration = UsageColumn("port",
                             verbose_name=_("Port Duration"),
                             summation="sum", sortable=True)
-    port_creation = tables.Column("port_create",
+    port_creation = UsageColumn("port_create",
                             verbose_name=_("Port Creation Requests"),
                             summation="sum", sortable=True)
-    router_duration = tables.Column("router",
+    router_duration = UsageColumn("router",
                             verbose_name=_("Router Duration"),
                             summation="sum", sortable=True)
-    router_creation = tables.Column("router_create",
+    router_creation = UsageColumn("router_create",
                             verbose_name=_("Router Creation Requests"),
                             summation="sum", sortable=True)
-    port_duration = tables.Column("port",
+    port_duration = UsageColumn("port",
                             verbose_name=_("Port Duration"),
                             summation="sum", sortable=True)
-    port_creation = tables.Column("port_create",
+    port_creation = UsageColumn("port_create",
                             verbose_name=_("Port Creation Requests"),
                             summation="sum", sortable=True)
-    ip_floating_duration = tables.Column("ip_floating",
+    ip_floating_duration = UsageColumn("ip_floating",
                             verbose_name=_("Floating IP Duration"),
                             summation="sum", sortable=True)
-    ip_floating_creation = tables.Column("ip_floating_create",
+    ip_floating_creation = UsageColumn("ip_floating_create",
                             verbose_name=_("Floating IP Creation Requests"),
                             summation="sum", sortable=True)
 
-    def get_object_id(self, datum):
-        return "%s%s%s" % (datum.tenant,
-                           datum.user,
-                           datum.resource)
-
     class Meta:
         name = "global_network_usage"
+        pagination_param = "global_network_usage_marker"
         verbose_name = _("Global Network Usage")
-        table_actions=(NetworkUsageFilterAction,)
+        table_actions=(UsageFilterAction,)
         multi_select = False
 
 
-class ObjectStoreUsageFilterAction(tables.FilterAction):
-    def filter(self, table, tenants, filter_string):
-        q = filter_string.lower()
-
-        def comp(tenant):
-            if q in tenant.name.lower():
-                return True
-            return False
-
-        return filter(comp, tenants)
-
-
-class ObjectStoreUsageTable(tables.DataTable):
+class ObjectStoreUsageTable(UsageTable):
     tenant = tables.Column("tenant", verbose_name=_("Tenant"))
     user = tables.Column("user", verbose_name=_("User"), sortable=True)
-    resource = tables.Column("resource",
+    resource = tables.Column(get_resource_name,
                              verbose_name=_("Resource"),
                              sortable=True)
-    storage_incoming_bytes = tables.Column(get_bytes("storage_objects_incoming_bytes"),
+    storage_incoming_bytes = UsageColumn("storage_objects_incoming_bytes",
                            verbose_name=_("Object Storage Incoming Bytes"),
+                           filters=(format_bytes,),
                            summation="sum", sortable=True)
-    storage_outgoing_bytes = tables.Column(get_bytes("storage_objects_outgoing_bytes"),
+    storage_outgoing_bytes = UsageColumn("storage_objects_outgoing_bytes",
                             verbose_name=_("Object Storage Outgoing Bytes"),
+                            filters=(format_bytes,),
                             summation="sum", sortable=True)
-    storage_objects = tables.Column("storage_objects",
+    storage_objects = UsageColumn("storage_objects",
                             verbose_name=_("Total Number of Objects"),
                             summation="sum", sortable=True)
-    storage_objects_size = tables.Column(get_bytes("storage_objects_size"),
+    storage_objects_size = UsageColumn("storage_objects_size",
                             verbose_name=_("Total Size of Objects "),
+                            filters=(format_bytes,),
                             summation="sum", sortable=True)
 
-    def get_object_id(self, datum):
-        return "%s%s%s" % (datum.tenant,
-                           datum.user,
-                           datum.resource)
-
     class Meta:
         name = "global_object_store_usage"
+        pagination_param = "global_object_store_usage_marker"
         verbose_name = _("Global Object Store Usage")
-        table_actions = (ObjectStoreUsageFilterAction,)
+        table_actions = (UsageFilterAction,)
         multi_select = False
 
 
-def get_cpu_time(sample):
-    cpu_seconds = sample.cpu / 1000000000
-    formatted_time = "%02d:%02d:%02d" % \
-        reduce(lambda a, b: divmod(a[0], b) + a[1:], [(cpu_seconds,), 60, 60])
-    return StringWithPlusOperationForTime(formatted_time)
-
-
-class CpuUsageTable(tables.DataTable):
+class CpuUsageTable(UsageTable):
     tenant = tables.Column("tenant", verbose_name=_("Tenant"))
     user = tables.Column("user", verbose_name=_("User"), sortable=True)
-    instance = tables.Column("resource",
+    instance = tables.Column(get_resource_name,
                              verbose_name=_("Resource"),
                              sortable=True)
-    cpu = tables.Column(get_cpu_time,
-                        verbose_name=_("CPU time"),
-                        summation="sum",
-                        sortable=True)
-
-    def get_object_id(self, datum):
-        return datum.tenant + datum.user + datum.resource
+    cpu = UsageColumn("cpu",
+                      verbose_name=_("CPU time"),
+                      filters=(format_cpu_time,),
+                      summation="sum",
+                      sortable=True)
 
     class Meta:
         name = "global_cpu_usage"
+        pagination_param = "global_cpu_usage_marker"
         verbose_name = _("Global CPU Usage")
-        table_actions = (CpuUsageFilterAction,)
+        table_actions = (UsageFilterAction,)
         multi_select = False
@@ -13,7 +13,6 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
-import operator
 
 from django.utils.translation import ugettext_lazy as _
 from django.core.context_processors import csrf
@@ -26,69 +25,92 @@ from .tables import (DiskUsageTable, NetworkTrafficUsageTable,
                      CpuUsageTable, ObjectStoreUsageTable, NetworkUsageTable)
 
 
-class DiskUsageTab(tabs.TableTab):
+class UsageTab(tabs.TableTab):
+    """
+    Base class of the tabs showing a paginated global usage table.
+    The footer totals of the table cover all the rows of the usage,
+    not only the rendered page.
+    """
+    template_name = ("horizon/common/_detail_table.html")
+    preload = False
+    usage_fields = ()
+
+    def get_usage_data(self, usage_func):
+        request = self.tab_group.request
+        table = self._tables[self.table_classes[0]._meta.name]
+        marker = request.GET.get(table._meta.pagination_param, None)
+        filter_string = self.get_filter_string(table)
+        usage, self._has_more = usage_func(request, marker=marker,
+                                           paginate=True,
+                                           filter_string=filter_string)
+        table.totals = ceilometer.global_usage_totals(request,
+                                                      self.usage_fields,
+                                                      filter_string)
+        return usage
+
+    def get_filter_string(self, table):
+        filter_action = table._meta._filter_action
+        if not filter_action:
+            return ""
+        param_name = filter_action.get_param_name()
+        # posted by the filter form, kept in the GET query of next pages
+        request = self.tab_group.request
+        filter_string = request.POST.get(param_name,
+                                         request.GET.get(param_name, ""))
+        return filter_string.strip()
+
+    def has_more_data(self, table):
+        return getattr(self, '_has_more', False)
+
+
+class DiskUsageTab(UsageTab):
     table_classes = (DiskUsageTable,)
     name = _("Global Disk Usage")
     slug = "global_disk_usage"
-    template_name = ("horizon/common/_detail_table.html")
+    usage_fields = ceilometer.DISK_USAGE_FIELDS
 
     def get_global_disk_usage_data(self):
-        request = self.tab_group.request
-        result = sorted(ceilometer.global_disk_usage(request),
-                        key=operator.itemgetter('tenant', 'user'))
-        return result
+        return self.get_usage_data(ceilometer.global_disk_usage)
 
 
-class NetworkTrafficUsageTab(tabs.TableTab):
+class NetworkTrafficUsageTab(UsageTab):
     table_classes = (NetworkTrafficUsageTable,)
     name = _("Global Network Traffic Usage")
     slug = "global_network_traffic_usage"
-    template_name = ("horizon/common/_detail_table.html")
+    usage_fields = ceilometer.NETWORK_TRAFFIC_USAGE_FIELDS
 
     def get_global_network_traffic_usage_data(self):
-        request = self.tab_group.request
-        result = sorted(ceilometer.global_network_traffic_usage(request),
-                        key=operator.itemgetter('tenant', 'user'))
-        return result
+        return self.get_usage_data(ceilometer.global_network_traffic_usage)
 
 
-class NetworkUsageTab(tabs.TableTab):
+class NetworkUsageTab(UsageTab):
     table_classes = (NetworkUsageTable,)
     name = _("Global Network Usage")
     slug = "global_network_usage"
-    template_name = ("horizon/common/_detail_table.html")
+    usage_fields = ceilometer.NETWORK_USAGE_FIELDS
 
     def get_global_network_usage_data(self):
-        request = self.tab_group.request
-        result = sorted(ceilometer.global_network_usage(request),
-                        key=operator.itemgetter('tenant', 'user'))
-        return result
+        return self.get_usage_data(ceilometer.global_network_usage)
 
 
-class CpuUsageTab(tabs.TableTab):
+class CpuUsageTab(UsageTab):
     table_classes = (CpuUsageTable,)
     name = _("Global CPU Usage")
     slug = "global_cpu_usage"
-    template_name = ("horizon/common/_detail_table.html")
+    usage_fields = ceilometer.CPU_USAGE_FIELDS
 
     def get_global_cpu_usage_data(self):
-        request = self.tab_group.request
-        result = sorted(ceilometer.global_cpu_usage(request),
-                        key=operator.itemgetter('tenant', 'user'))
-        return result
+        return self.get_usage_data(ceilometer.global_cpu_usage)
 
 
-class GlobalObjectStoreUsageTab(tabs.TableTab):
+class GlobalObjectStoreUsageTab(UsageTab):
     table_classes = (ObjectStoreUsageTable,)
     name = _("Global Object Store Usage")
     slug = "global_object_store_usage"
-    template_name = ("horizon/common/_detail_table.html")
+    usage_fields = ceilometer.OBJECT_STORE_USAGE_FIELDS
 
     def get_global_object_store_usage_data(self):
-        request = self.tab_group.request
-        result = sorted(ceilometer.global_object_store_usage(request),
-                        key=operator.itemgetter('tenant', 'user'))
-        return result
+        return self.get_usage_data(ceilometer.global_object_store_usage)
 
 
 class StatsTab(tabs.Tab):
@@ -97,10 +119,6 @@ class StatsTab(tabs.Tab):
     template_name = ("admin/ceilometer/stats.html")
 
     def get_context_data(self, request):
-        context = {}
-        meter_list = ceilometer.meter_list(self.request)
-
-        meters = []
         meter_types = [
             ("Compute", [
                 {"name": "cpu", "unit": "ns", "type": "cumulative"},
@@ -135,19 +153,8 @@ class StatsTab(tabs.Tab):
                          "type": "delta"}])
         ]
 
-        # grab different resources for metrics,
-        # and associate with the right type
-        meters = ceilometer.meter_list(self.request)
-        resources = {}
-        for meter in meters:
-            # group resources by meter names
-            if meter.type=='delta' or meter.type=='cumulative':
-                if meter.name not in resources:
-                    resources[meter.name] = []
-                if meter.resource_id not in resources[meter.name]:
-                    resources[meter.name].append(meter.resource_id)
-
-        context = {'meters': meter_types, 'resources': resources}
+        # the resources of the selected meter are loaded by the page
+        context = {'meters': meter_types}
         context.update(csrf(request))
         return context
 
@@ -156,3 +163,15 @@ class CeilometerOverviewTabs(tabs.TabGroup):
     tabs = (DiskUsageTab, NetworkTrafficUsageTab, NetworkUsageTab,
             GlobalObjectStoreUsageTab, CpuUsageTab, StatsTab,)
     sticky = True
+
+    def __init__(self, request, **kwargs):
+        super(CeilometerOverviewTabs, self).__init__(request, **kwargs)
+        # Let the usage of every tab loaded by this request be fetched
+        # in one pass. Usage tabs are not preloaded, so this is only the
+        # active one. get_loaded_tabs() would give every allowed and
+        # enabled tab, Tab.load tells the ones rendered.
+        loader = ceilometer.usage_loader(request)
+        for tab in [t for t in self.get_tabs() if t.load]:
+            fields = getattr(tab, 'usage_fields', None)
+            if fields:
+                loader.register(fields)
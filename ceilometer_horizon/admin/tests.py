@@ -13,3 +13,642 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+
+import time
+from datetime import datetime, timedelta
+
+from ceilometerclient import exc as ceilometer_exc
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..api import ceilometer
+from ..api import timeseries
+
+
+TENANTS = {"t1": "admin", "t2": "admin2", "t3": "demo"}
+USERS = {"u1": "joe", "u2": "jane"}
+
+
+class FakeResource(object):
+    def __init__(self, **info):
+        self._info = info
+
+
+def _matches(info, query):
+    """Whether a fake row matches a Ceilometer query."""
+    fields = {"project": "project_id", "user": "user_id",
+              "resource": "resource_id", "timestamp": "timestamp"}
+    for constraint in query or []:
+        value = info.get(fields[constraint['field']])
+        expected = constraint['value']
+        if constraint['field'] == "timestamp":
+            if value is None:
+                return False
+            value = value.replace(" ", "T")
+            expected = expected.replace(" ", "T")
+        op = constraint['op']
+        if not {'eq': value == expected, 'lt': value < expected,
+                'le': value <= expected, 'gt': value > expected,
+                'ge': value >= expected}[op]:
+            return False
+    return True
+
+
+class FakeStatistics(object):
+    def __init__(self, usage):
+        self.usage = usage
+        self.calls = 0
+
+    def list(self, meter_name, q, groupby=None, period=None):
+        self.calls += 1
+        rows = [r for r in self.usage
+                if r['counter_name'] == meter_name and _matches(r, q)]
+        if not groupby:
+            if not rows:
+                return []
+            return [FakeResource(max=max(r['total'] for r in rows))]
+        groups = {}
+        for row in rows:
+            key = tuple(row[f] for f in groupby)
+            groups[key] = max(groups.get(key, 0), row['total'])
+        return [FakeResource(max=total, groupby=dict(zip(groupby, key)))
+                for key, total in groups.items()]
+
+
+class FakeSamples(object):
+    def __init__(self, samples):
+        self.samples = samples
+        self.calls = 0
+
+    def list(self, meter_name, q, limit=None):
+        self.calls += 1
+        # newest first, as the Ceilometer API returns them
+        rows = sorted([s for s in self.samples
+                       if s['counter_name'] == meter_name and
+                       _matches(s, q)],
+                      key=lambda s: s['timestamp'], reverse=True)
+        return [FakeResource(**s) for s in rows[:limit]]
+
+
+class FakeMeters(object):
+    def __init__(self, meters):
+        self.meters = meters
+
+    def list(self, q=None):
+        return [FakeResource(**m) for m in self.meters]
+
+
+class FakeResources(object):
+    def __init__(self, resources):
+        self.resources = resources
+
+    def list(self, q=None):
+        return [FakeResource(**r) for r in self.resources]
+
+
+class FakeClient(object):
+    def __init__(self, usage=(), samples=(), meters=(), resources=()):
+        self.statistics = FakeStatistics(list(usage))
+        self.samples = FakeSamples(list(samples))
+        self.meters = FakeMeters(list(meters))
+        self.resources = FakeResources(list(resources))
+
+
+class FakeRequest(object):
+    pass
+
+
+class CeilometerTestCase(TestCase):
+    """Runs the api against a FakeClient, with stubbed identities."""
+    def setUp(self):
+        cache.clear()
+        self.client = FakeClient()
+        self._stubs = {}
+        self.stub('ceilometerclient', lambda request: self.client)
+        self.stub('identity_index', lambda request: (USERS, TENANTS))
+        self.stub('_groupby_supported', [None])
+
+    def tearDown(self):
+        for name, value in self._stubs.items():
+            setattr(ceilometer, name, value)
+        cache.clear()
+
+    def stub(self, name, value):
+        self._stubs.setdefault(name, getattr(ceilometer, name))
+        setattr(ceilometer, name, value)
+
+
+class FakeToken(object):
+    id = "token"
+    expires = None
+
+
+class FakeUser(object):
+    token = FakeToken()
+    services_region = "RegionOne"
+
+
+class ClientCacheTests(CeilometerTestCase):
+    def test_endpoint_looked_up_once_per_token(self):
+        urls = []
+
+        def url_for(request, service_type):
+            urls.append(service_type)
+            return "http://ceilometer:8777/v2"
+
+        class FakeClientModule(object):
+            @staticmethod
+            def Client(version, endpoint, **kwargs):
+                return FakeClient()
+
+        self.stub('url_for', url_for)
+        self.stub('ceilometer_client', FakeClientModule)
+        self.stub('_client_cache', {})
+        request = FakeRequest()
+        request.user = FakeUser()
+        client = self._stubs['ceilometerclient'](request)
+        self.assertTrue(self._stubs['ceilometerclient'](request) is client)
+        self.assertEqual(urls, ["metering"])
+
+
+class FanOutTests(TestCase):
+    def test_results_in_order(self):
+        def call(request, delay, value):
+            # the first calls finish last
+            time.sleep(delay)
+            return value
+        args_list = [(None, 0.03 * (5 - i), i) for i in range(5)]
+        self.assertEqual(ceilometer.fan_out(call, args_list),
+                         [0, 1, 2, 3, 4])
+
+    def test_failure_replaced_by_default(self):
+        def call(request, value):
+            if value == 1:
+                raise ceilometer_exc.HTTPBadRequest()
+            return value
+        args_list = [(None, i) for i in range(3)]
+        self.assertEqual(ceilometer.fan_out(call, args_list, default=-1),
+                         [0, -1, 2])
+
+    def test_other_errors_raised(self):
+        def call(request):
+            raise KeyError()
+        self.assertRaises(KeyError, ceilometer.fan_out, call, [(None,)])
+
+    @override_settings(CEILOMETER_API_CONCURRENCY=2)
+    def test_timeout_bounds_the_fan_out(self):
+        def call(request, delay):
+            time.sleep(delay)
+            return delay
+        args_list = [(None, 0)] + [(None, 1)] * 6
+        started = time.time()
+        results = ceilometer.fan_out(call, args_list, timeout=0.2)
+        # not 0.2 seconds per hanging call
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual(results, [0] + [None] * 6)
+
+
+def usage_row(tenant, user, resource, counter, total):
+    return {"project_id": tenant, "user_id": user, "resource_id": resource,
+            "counter_name": counter, "total": total}
+
+
+class UsageFilterTests(CeilometerTestCase):
+    def setUp(self):
+        super(UsageFilterTests, self).setUp()
+        self.client = FakeClient(usage=[
+            usage_row("t1", "u1", "inst-1", "cpu", 5),
+            usage_row("t2", "u1", "inst-2", "cpu", 7),
+            usage_row("t3", "u2", "vm-3", "cpu", 9)])
+
+    def test_parse_usage_filter(self):
+        constraints, terms = ceilometer.parse_usage_filter(
+            "Tenant:Admin foo resource:inst bar user:")
+        self.assertEqual(constraints, {"tenant": "admin",
+                                       "resource": "inst"})
+        self.assertEqual(terms, ["foo", "bar", "user:"])
+
+    def test_usage_index(self):
+        rows = [{"tenant": "admin", "user": "joe", "resource": "inst-1",
+                 "resource_name": "web"},
+                {"tenant": "admin2", "user": "joe", "resource": "inst-2",
+                 "resource_name": "db"},
+                {"tenant": "demo", "user": "jane", "resource": "vm-3",
+                 "resource_name": "vm-3"}]
+        index = ceilometer.UsageIndex(rows)
+        # resources match by the name shown or by id
+        self.assertEqual(index.filter({"resource": "we"}, []), rows[:1])
+        self.assertEqual(index.filter({"resource": "inst"}, []), rows[:2])
+        self.assertEqual(index.filter({}, ["db"]), rows[1:2])
+        self.assertEqual(index.filter({"tenant": "admin"}, []), rows[:2])
+        self.assertEqual(index.filter({"tenant": "admin2"}, []), rows[1:2])
+        self.assertEqual(index.filter({}, ["ja"]), rows[2:])
+        self.assertEqual(index.filter({"user": "joe"}, ["2"]), rows[1:2])
+        self.assertEqual(index.filter({}, []), rows)
+        self.assertEqual(index.filter({"resource": "x"}, []), [])
+
+    def _resources(self, rows):
+        return sorted(row['resource'] for row in rows)
+
+    def _filter_cold_and_warm(self, filter_string):
+        fields = ceilometer.CPU_USAGE_FIELDS
+        cold = ceilometer.UsageLoader(FakeRequest()).get(fields,
+                                                         filter_string)
+        ceilometer.UsageLoader(FakeRequest()).get(fields)
+        warm = ceilometer.UsageLoader(FakeRequest()).get(fields,
+                                                         filter_string)
+        return self._resources(cold), self._resources(warm)
+
+    @override_settings(CEILOMETER_USAGE_ROLLUPS=False)
+    def test_filter_same_rows_cold_and_warm(self):
+        for filter_string, expected in (
+                ("resource:inst", ["inst-1", "inst-2"]),
+                ("tenant:admin", ["inst-1", "inst-2"]),
+                ("tenant:admin2", ["inst-2"]),
+                ("tenant:de user:ja", ["vm-3"]),
+                ("user:joe 2", ["inst-2"])):
+            cold, warm = self._filter_cold_and_warm(filter_string)
+            self.assertEqual(cold, expected, filter_string)
+            self.assertEqual(warm, expected, filter_string)
+            cache.clear()
+
+    @override_settings(CEILOMETER_USAGE_ROLLUPS=False)
+    def test_filter_same_rows_for_unknown_ids(self):
+        self.stub('identity_index', lambda request: (
+            USERS, {"a1d0": "admin", "b2e0": "demo"}))
+        # ad03 is not in keystone, its rows show the id
+        self.client = FakeClient(usage=[
+            usage_row("a1d0", "u1", "inst-1", "cpu", 5),
+            usage_row("ad03", "u1", "inst-2", "cpu", 7),
+            usage_row("b2e0", "u2", "vm-3", "cpu", 9)])
+        cold, warm = self._filter_cold_and_warm("tenant:ad")
+        self.assertEqual(cold, ["inst-1", "inst-2"])
+        self.assertEqual(warm, ["inst-1", "inst-2"])
+
+    @override_settings(CEILOMETER_USAGE_ROLLUPS=False)
+    def test_filter_pushed_down_for_single_match(self):
+        fields = ceilometer.CPU_USAGE_FIELDS
+        usage = ceilometer.UsageLoader(FakeRequest()).get(fields,
+                                                          "tenant:admin2")
+        self.assertEqual(self._resources(usage), ["inst-2"])
+        # the whole usage was not computed, hence not cached
+        self.assertEqual(cache.get(ceilometer._usage_cache_key(fields)),
+                         None)
+
+
+@override_settings(CEILOMETER_USAGE_ROLLUPS=False, API_RESULT_PAGE_SIZE=1)
+class UsagePaginationTests(CeilometerTestCase):
+    def test_pages_follow_markers(self):
+        # the names of both rows concatenate to the same string
+        self.stub('identity_index', lambda request: (
+            {"u1": "c", "u2": "bc"}, {"t1": "a&b", "t2": "a&"}))
+        self.client = FakeClient(usage=[
+            usage_row("t1", "u1", "inst/1", "cpu", 5),
+            usage_row("t2", "u2", "inst/1", "cpu", 7),
+            usage_row("t2", "u2", "inst/2", "cpu", 9),
+            usage_row("t1", "u1", "inst/3", "cpu", 3)])
+        fields = ceilometer.CPU_USAGE_FIELDS
+        seen = []
+        marker = None
+        for i in range(5):
+            page, has_more = ceilometer.global_usage(
+                FakeRequest(), fields, marker=marker, paginate=True)
+            seen.extend((row["tenant"], row["resource"]) for row in page)
+            if not has_more:
+                break
+            marker = ceilometer.usage_id(page[-1])
+        self.assertEqual(seen, [("a&", "inst/1"), ("a&", "inst/2"),
+                                ("a&b", "inst/1"), ("a&b", "inst/3")])
+
+
+class OldFakeStatistics(FakeStatistics):
+    """Statistics of a client without group-by."""
+    def list(self, meter_name, q):
+        return FakeStatistics.list(self, meter_name, q)
+
+
+class BadRequestStatistics(FakeStatistics):
+    """Statistics of an API rejecting the queries given."""
+    def __init__(self, usage, reject):
+        super(BadRequestStatistics, self).__init__(usage)
+        self.reject = reject
+
+    def list(self, meter_name, q, groupby=None, period=None):
+        if self.reject(q, groupby):
+            self.calls += 1
+            raise ceilometer_exc.HTTPBadRequest()
+        return super(BadRequestStatistics, self).list(meter_name, q,
+                                                      groupby, period)
+
+
+@override_settings(CEILOMETER_USAGE_ROLLUPS=False)
+class GroupByTests(CeilometerTestCase):
+    def setUp(self):
+        super(GroupByTests, self).setUp()
+        self.usage = [usage_row("t1", "u1", "inst-1", "cpu", 5),
+                      usage_row("t3", "u2", "vm-3", "cpu", 9)]
+        meters = [{"name": "cpu", "type": "cumulative",
+                   "resource_id": r["resource_id"],
+                   "user_id": r["user_id"], "project_id": r["project_id"]}
+                  for r in self.usage]
+        self.client = FakeClient(usage=self.usage, meters=meters)
+
+    def totals(self, query=None):
+        fields = ceilometer.CPU_USAGE_FIELDS
+        usage = ceilometer._global_usage(FakeRequest(), [fields],
+                                         query)[fields]
+        return sorted((row["resource"], row["cpu"]) for row in usage)
+
+    def test_grouped(self):
+        self.assertEqual(self.totals(), [("inst-1", 5), ("vm-3", 9)])
+        # the support probe, then one call for the only counter
+        self.assertEqual(self.client.statistics.calls, 2)
+        self.totals()
+        self.assertEqual(self.client.statistics.calls, 3)
+
+    def test_fallback_without_client_support(self):
+        self.client.statistics = OldFakeStatistics(self.usage)
+        self.assertEqual(self.totals(), [("inst-1", 5), ("vm-3", 9)])
+        # one call per meter
+        self.assertEqual(self.client.statistics.calls, 2)
+
+    def test_fallback_without_api_support(self):
+        self.client.statistics = BadRequestStatistics(
+            self.usage, lambda q, groupby: groupby)
+        self.assertEqual(self.totals(), [("inst-1", 5), ("vm-3", 9)])
+        self.assertEqual(self.client.statistics.calls, 3)
+        self.assertEqual(ceilometer._groupby_supported, [False])
+
+    def test_rejected_query_keeps_groupby(self):
+        # a query rejected for its user constraint, not for group-by
+        self.client.statistics = BadRequestStatistics(
+            self.usage, lambda q, groupby: any(c["field"] == "user"
+                                               for c in q))
+        self.assertEqual(self.totals(ceilometer.get_query("u1", None,
+                                                          None)), [])
+        self.assertEqual(ceilometer._groupby_supported, [True])
+        self.assertEqual(self.totals(), [("inst-1", 5), ("vm-3", 9)])
+
+
+def hourly_samples(start, hours, counter="cpu", resource="r1", step=10):
+    """Samples of a cumulative counter growing by step every hour."""
+    return [{"counter_name": counter, "resource_id": resource,
+             "counter_type": "cumulative",
+             "timestamp": (start + timedelta(hours=i)).isoformat(),
+             "counter_volume": float(step * (i + 1)),
+             "message_id": "%s-%d" % (resource, i)}
+            for i in range(hours)]
+
+
+class SampleSeriesTests(CeilometerTestCase):
+    def setUp(self):
+        super(SampleSeriesTests, self).setUp()
+        self.client = FakeClient(
+            samples=hourly_samples(datetime(2013, 4, 30), 24 * 10))
+
+    def series(self, start, end):
+        return ceilometer.sample_series(FakeRequest(), "cpu", "r1", start,
+                                        end)
+
+    def test_one_request_per_short_chart(self):
+        meter_type, series = self.series(datetime(2013, 5, 1),
+                                         datetime(2013, 5, 5, 23, 59, 59))
+        self.assertEqual(meter_type, "cumulative")
+        self.assertEqual(len(series), 24 * 5)
+        # the first increase is taken from the sample before the range
+        self.assertEqual(list(series.values), [10.0] * (24 * 5))
+        self.assertEqual(self.client.samples.calls, 1)
+
+    def test_long_chart_windowed_by_default(self):
+        self.client = FakeClient(
+            samples=hourly_samples(datetime(2013, 4, 30), 24 * 30))
+        meter_type, series = self.series(datetime(2013, 5, 1),
+                                         datetime(2013, 5, 20, 23, 59, 59))
+        self.assertEqual(len(series), 24 * 20)
+        # the baseline hour and 20 days, one week at a time
+        self.assertEqual(self.client.samples.calls, 3)
+
+    def test_chunks_same_as_series(self):
+        start, end = datetime(2013, 5, 1), datetime(2013, 5, 7, 23, 59, 59)
+        meter_type, chunks = ceilometer.sample_chunks(FakeRequest(), "cpu",
+                                                      "r1", start, end)
+        streamed = timeseries.concat(chunks)
+        meter_type, series = self.series(start, end)
+        self.assertEqual(meter_type, "cumulative")
+        self.assertEqual(list(streamed.timestamps), list(series.timestamps))
+        self.assertEqual(list(streamed.values), list(series.values))
+
+    @override_settings(CEILOMETER_SAMPLE_WINDOW=86400)
+    def test_windowed_requests(self):
+        meter_type, series = self.series(datetime(2013, 5, 1),
+                                         datetime(2013, 5, 7, 23, 59, 59))
+        self.assertEqual(len(series), 24 * 7)
+        self.assertEqual(self.client.samples.calls, 8)
+
+    def test_cached_series_extended(self):
+        self.series(datetime(2013, 5, 3), datetime(2013, 5, 5))
+        calls = self.client.samples.calls
+        meter_type, merged = self.series(datetime(2013, 5, 1),
+                                         datetime(2013, 5, 7))
+        # only the samples before and after the cached ones are asked
+        self.assertEqual(self.client.samples.calls - calls, 2)
+
+        cache.clear()
+        meter_type, fresh = self.series(datetime(2013, 5, 1),
+                                        datetime(2013, 5, 7))
+        self.assertEqual(list(merged.timestamps), list(fresh.timestamps))
+        self.assertEqual(list(merged.values), list(fresh.values))
+
+    def test_sample_names_from_directory(self):
+        sample = ceilometer.sample_list(FakeRequest(), "cpu", limit=1)[0]
+        self.assertEqual((sample.name, sample.instance), ("", None))
+        cache.set(ceilometer.RESOURCE_DIRECTORY_CACHE_KEY,
+                  {"r1": ("web", "m1.small")})
+        self.assertEqual((sample.name, sample.instance), ("web", "web"))
+
+    def test_cached_series_sliced(self):
+        self.series(datetime(2013, 5, 1), datetime(2013, 5, 7))
+        calls = self.client.samples.calls
+        meter_type, series = self.series(datetime(2013, 5, 2),
+                                         datetime(2013, 5, 3))
+        self.assertEqual(self.client.samples.calls, calls)
+        self.assertEqual(len(series), 25)
+
+
+def shared_samples(sample, count):
+    """count samples of the same timestamp as sample."""
+    return [dict(sample, message_id="%s-%d" % (sample["message_id"], i))
+            for i in range(count)]
+
+
+@override_settings(CEILOMETER_SAMPLE_PAGE_SIZE=3)
+class SamplePagesTests(CeilometerTestCase):
+    def pages(self, samples):
+        self.client = FakeClient(samples=samples)
+        return [s.message_id for s in ceilometer.sample_pages(
+            FakeRequest(), "cpu", end=datetime(2013, 5, 2))]
+
+    def test_full_page_sharing_a_timestamp(self):
+        samples = hourly_samples(datetime(2013, 5, 1), 10)
+        # a page of samples share hour 7, the first page ends at it
+        samples += shared_samples(samples[7], 2)
+        message_ids = self.pages(samples)
+        self.assertEqual(sorted(message_ids),
+                         sorted(s["message_id"] for s in samples))
+
+    def test_crowded_timestamp_skipped(self):
+        samples = hourly_samples(datetime(2013, 5, 1), 10)
+        crowded = [samples[5]] + shared_samples(samples[5], 3)
+        message_ids = self.pages(samples + crowded[1:])
+        self.assertEqual(len(message_ids), len(set(message_ids)))
+        # a page of the 4 samples at hour 5 is retrieved, the older
+        # samples are not lost
+        at_hour_5 = set(s["message_id"] for s in crowded)
+        self.assertEqual(len(at_hour_5.intersection(message_ids)), 3)
+        self.assertEqual(sorted(set(message_ids) - at_hour_5),
+                         sorted("r1-%d" % i for i in range(10) if i != 5))
+
+    def test_identical_samples_without_message_id(self):
+        samples = [dict(s, message_id=None)
+                   for s in hourly_samples(datetime(2013, 5, 1), 5)]
+        # three identical samples at hour 2, over two pages
+        samples += [dict(samples[2]), dict(samples[2])]
+        self.client = FakeClient(samples=samples)
+        volumes = [s.counter_volume for s in ceilometer.sample_pages(
+            FakeRequest(), "cpu", end=datetime(2013, 5, 2))]
+        self.assertEqual(sorted(volumes),
+                         [10.0, 20.0, 30.0, 30.0, 30.0, 40.0, 50.0])
+
+    def test_iter_chronological(self):
+        samples = hourly_samples(datetime(2013, 5, 1), 10)
+        self.client = FakeClient(samples=samples)
+        message_ids = [s.message_id for s in ceilometer.sample_iter(
+            FakeRequest(), "cpu", start=datetime(2013, 5, 1),
+            end=datetime(2013, 5, 2))]
+        self.assertEqual(message_ids, [s["message_id"] for s in samples])
+
+
+def meter(name, resource_id, meter_type="cumulative"):
+    return {"name": name, "type": meter_type, "resource_id": resource_id}
+
+
+class MeterCatalogTests(CeilometerTestCase):
+    def setUp(self):
+        super(MeterCatalogTests, self).setUp()
+        self.client = FakeClient(meters=[
+            meter("cpu", "inst-3"), meter("cpu", "inst-1"),
+            meter("cpu", "vm-1"), meter("cpu", "inst-2"),
+            meter("cpu", "inst-1"), meter("cpu", None),
+            meter("disk.read.bytes", "inst-9"),
+            meter("cpu_util", "inst-1", "gauge")])
+        self.catalog = ceilometer.meter_catalog(FakeRequest())
+
+    def test_names(self):
+        self.assertEqual(self.catalog.names(["cumulative"]),
+                         set(["cpu", "disk.read.bytes"]))
+        self.assertEqual(self.catalog.names(["gauge", "delta"]),
+                         set(["cpu_util"]))
+
+    def test_resources(self):
+        self.assertEqual(self.catalog.resources("cpu"),
+                         (["inst-1", "inst-2", "inst-3", "vm-1"], False))
+        self.assertEqual(self.catalog.resources("cpu", "inst"),
+                         (["inst-1", "inst-2", "inst-3"], False))
+        self.assertEqual(self.catalog.resources("cpu", "x"), ([], False))
+        self.assertEqual(self.catalog.resources("memory"), ([], False))
+
+    def test_resources_paging(self):
+        self.assertEqual(self.catalog.resources("cpu", "inst", limit=2),
+                         (["inst-1", "inst-2"], True))
+        self.assertEqual(self.catalog.resources("cpu", "inst",
+                                                marker="inst-2", limit=2),
+                         (["inst-3"], False))
+        # a page filled exactly has no more
+        self.assertEqual(self.catalog.resources("cpu", marker="inst-2",
+                                                limit=2),
+                         (["inst-3", "vm-1"], False))
+
+
+class SeriesTests(TestCase):
+    def test_deltas(self):
+        series = timeseries.Series([0, 60, 120, 180], [5, 8, 2, 6])
+        increases, last = series.deltas(previous=4)
+        # 2 follows a counter reset, its increase is the value itself
+        self.assertEqual(list(increases.values), [1, 3, 2, 4])
+        self.assertEqual(list(increases.timestamps), [0, 60, 120, 180])
+        self.assertEqual(last, 6)
+
+    def test_iter_deltas_across_chunks(self):
+        chunks = [timeseries.Series([0, 60], [1, 3]),
+                  timeseries.Series([120, 180], [6, 10])]
+        increases = timeseries.concat(timeseries.iter_deltas(chunks))
+        self.assertEqual(list(increases.values), [1, 2, 3, 4])
+
+    def test_bucket(self):
+        series = timeseries.Series([0, 10, 3600, 3700, 7300],
+                                   [1, 3, 5, 7, 9])
+        buckets = series.bucket(3600, 'avg')
+        self.assertEqual(list(buckets.timestamps), [0, 3600, 7200])
+        self.assertEqual(list(buckets.values), [2, 6, 9])
+        self.assertEqual(list(series.bucket(3600, 'sum').values),
+                         [4, 12, 9])
+
+    def test_iter_buckets_across_chunks(self):
+        # the hour starting at 3600 spans both chunks
+        chunks = [timeseries.Series([0, 3600], [1, 2]),
+                  timeseries.Series([3700, 7300], [4, 5])]
+        buckets = timeseries.concat(
+            timeseries.iter_buckets(chunks, 3600, 'sum'))
+        self.assertEqual(list(buckets.timestamps), [0, 3600, 7200])
+        self.assertEqual(list(buckets.values), [1, 6, 5])
+
+    def test_parse_timestamp(self):
+        self.assertEqual(timeseries.parse_timestamp("1970-01-02T01:00:05"),
+                         86400 + 3605)
+        self.assertEqual(
+            timeseries.parse_timestamp("1970-01-02T01:00:05.123456"),
+            86400 + 3605)
+
+
+class DecimationTests(TestCase):
+    def setUp(self):
+        # a flat line with a spike at 500 and a dip at 700
+        values = [0.0] * 1000
+        values[500] = 100.0
+        values[700] = -100.0
+        self.series = timeseries.Series(range(1000), values)
+
+    def test_lttb(self):
+        decimated = timeseries.lttb(self.series, 50)
+        self.assertEqual(len(decimated), 50)
+        self.assertEqual(decimated.timestamps[0], 0)
+        self.assertEqual(decimated.timestamps[-1], 999)
+        self.assertTrue(100.0 in decimated.values)
+        self.assertTrue(-100.0 in decimated.values)
+        self.assertEqual(list(decimated.timestamps),
+                         sorted(decimated.timestamps))
+
+    def test_minmax(self):
+        decimated = timeseries.minmax(self.series, 50)
+        self.assertTrue(len(decimated) <= 50)
+        self.assertTrue(100.0 in decimated.values)
+        self.assertTrue(-100.0 in decimated.values)
+        self.assertEqual(list(decimated.timestamps),
+                         sorted(decimated.timestamps))
+
+    def test_bounded_below_3_points(self):
+        self.assertEqual(list(timeseries.lttb(self.series, 2).timestamps),
+                         [0, 999])
+        # one bucket, its lowest and highest points
+        self.assertEqual(list(timeseries.minmax(self.series, 2).values),
+                         [100.0, -100.0])
+        for decimate in (timeseries.lttb, timeseries.minmax):
+            self.assertEqual(list(decimate(self.series, 1).timestamps),
+                             [0])
+
+    def test_short_series_unchanged(self):
+        series = timeseries.Series([0, 1, 2], [1, 2, 3])
+        self.assertTrue(timeseries.lttb(series, 10) is series)
+        self.assertTrue(timeseries.minmax(series, 10) is series)
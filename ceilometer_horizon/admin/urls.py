@@ -16,11 +16,21 @@
 
 from django.conf.urls.defaults import patterns, url
 
-from .views import IndexView, SamplesView, ExportView
+from .views import IndexView, SamplesView, BatchSamplesView, ChartView
+from .views import ResourcesView
+from .views import ExportView, ExportStatusView, ExportDownloadView
 
 
 urlpatterns = patterns('openstack_dashboard.dashboards.admin.ceilometer.views',
     url(r'^$', IndexView.as_view(), name='index'),
     url(r'^samples$', SamplesView.as_view(), name='samples'),
-    url(r'^export$', ExportView.as_view(), name='export'))
+    url(r'^samples/batch$', BatchSamplesView.as_view(),
+        name='samples_batch'),
+    url(r'^chart$', ChartView.as_view(), name='chart'),
+    url(r'^resources$', ResourcesView.as_view(), name='resources'),
+    url(r'^export$', ExportView.as_view(), name='export'),
+    url(r'^export/(?P<job>[0-9a-f]{40})$', ExportStatusView.as_view(),
+        name='export_status'),
+    url(r'^export/(?P<job>[0-9a-f]{40})/pdf$', ExportDownloadView.as_view(),
+        name='export_download'))
 
@@ -16,165 +16,427 @@
 
 import logging
 import csv
+import json
 from datetime import datetime, timedelta
 
 from horizon import tabs
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.utils.translation import ugettext as _
+from django.middleware.gzip import GZipMiddleware
 from django.views.generic import View
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5, HttpResponse consumes iterators lazily.
+    StreamingHttpResponse = HttpResponse
 
+from . import export
 from .tabs import CeilometerOverviewTabs
 from ..api import ceilometer
+from ..api import timeseries
 
-from svglib.svglib import SvgRenderer
-from reportlab.graphics import renderPDF
-import xml.dom.minidom
 import itertools
 import operator
 
 LOG = logging.getLogger(__name__)
 
+# Statistics periods, in seconds, charts can be downsampled to.
+PERIODS = (300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400,
+           7 * 86400)
+
+# Width and height in pixels of the chart when the request does not give
+# them.
+DEFAULT_CHART_WIDTH = 800
+DEFAULT_CHART_HEIGHT = 400
+
+# Largest width or height in pixels of a chart, server rendered ones are
+# drawn in memory.
+MAX_CHART_SIZE = 4000
+
+# Smallest width and height in pixels of a server rendered chart, which
+# has margins of 90 and 100 pixels around its plot.
+MIN_CHART_WIDTH = 200
+MIN_CHART_HEIGHT = 150
+
 
 class IndexView(tabs.TabbedTableView):
     tab_group_class = CeilometerOverviewTabs
     template_name = 'admin/ceilometer/index.html'
 
-# convert all items in list to hour level
-def to_hours(item):
-    date_obj = datetime.strptime(item[0], '%Y-%m-%dT%H:%M:%S')
-    new_date_str = date_obj.strftime("%Y-%m-%dT%H:00:00")
-    return (new_date_str, item[1])
-
-# convert all items in list to day level
-def to_days(item):
-    date_obj = datetime.strptime(item[0], '%Y-%m-%dT%H:%M:%S')
-    new_date_str = date_obj.strftime("%Y-%m-%dT00:00:00")
-    return (new_date_str, item[1])
-
-# given a set of metrics with same key, group them and calc average
-def reduce_metrics(samples):
-    new_samples = []
-    for key, items in itertools.groupby(samples, operator.itemgetter(0)):
-        grouped_items = []
-        for item in items:
-            grouped_items.append(item[1])
-        item_len = len(grouped_items)
-        if item_len>0:
-            avg = reduce(lambda x, y: x+y, grouped_items)/item_len
-        else:
-            avg = 0
 
-        new_samples.append([key, avg])
-    return new_samples
+# smallest statistics period giving at most one point per pixel
+def chart_period(start, end, width):
+    delta = end - start
+    seconds = delta.days * 86400 + delta.seconds
+    for period in PERIODS:
+        if period * width >= seconds:
+            return period
+    return PERIODS[-1]
 
-class SamplesView(View):
 
-    # converts string to date
-    def _to_iso_time(self, date_str):
-        date_object = datetime.strptime(date_str, '%m/%d/%Y %H:%M:%S')
-        return date_object.isoformat(' ')
-
-    # grab the latest sample value before that date
-    def _get_previous_val(self, source, resource, limit_date):
-        # give 1 hour of margin to grab latest sample
-        date_object = datetime.strptime(limit_date, '%Y-%m-%d %H:%M:%S')
-        edge_date = date_object - timedelta(hours=1)
-        edge_date_str = edge_date.strftime('%Y-%m-%d %H:%M:%S')
-
-        query = [
-            {'field':'timestamp', 'op':'ge', 'value':edge_date_str},
-            {'field':'timestamp', 'op':'lt', 'value':limit_date},
-            {'field':'resource', 'op':'eq', 'value':resource}
-        ]
-        sample_list = ceilometer.sample_list(self.request, source, query)
-        if len(sample_list)>0:
-            # grab latest item
-            last = sample_list[-1]
-            return last.counter_volume
-        else:
-            return 0
+# Compress a response the client accepts gzipped. Only used for complete
+# responses: on Django < 1.5 compressing a streamed one would read it all
+# in memory.
+def gzip(request, response):
+    return GZipMiddleware().process_response(request, response)
+
+
+class Echo(object):
+    """File-like object returning what is written, to stream csv rows."""
+    def write(self, value):
+        return value
+
+
+def csv_lines(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class SamplesView(View):
 
     def get(self, request, *args, **kwargs):
         source = request.GET.get('sample', '')
-        date_from = request.GET.get('from', '')
-        date_to = request.GET.get('to', '')
         resource = request.GET.get('resource', '')
-        query = []
-        rows = []
+        meter_type = request.GET.get('type', '')
+        params = self._chart_params(request)
+        response_format = self._response_format(request)
 
+        series = []
+        if source and resource:
+            series = self._chart_series(request, source, resource,
+                                        meter_type, *params,
+                                        stream=response_format=="csv")
+
+        if response_format=="json":
+            return gzip(request, HttpResponse(
+                json.dumps(timeseries.concat(series).compact()),
+                content_type='application/json'))
+        if response_format=="binary":
+            return gzip(request, HttpResponse(
+                timeseries.concat(series).pack(),
+                content_type='application/octet-stream'))
+
+        # stream csv, samples are never all held in memory
+        rows = itertools.chain.from_iterable(s.rows() for s in series)
+        headers = ['date', 'value']
+        return StreamingHttpResponse(csv_lines(headers, rows),
+                                     content_type='text/csv')
+
+    # csv unless the format parameter or the Accept header asks for
+    # compact json or binary series
+    def _response_format(self, request):
+        response_format = request.GET.get('format')
+        if response_format in ("csv", "json", "binary"):
+            return response_format
+        accept = request.META.get('HTTP_ACCEPT', '')
+        if 'application/json' in accept:
+            return "json"
+        if 'application/octet-stream' in accept:
+            return "binary"
+        return "csv"
+
+    # read the range, width and decimation of the chart
+    def _chart_params(self, request):
+        start = end = None
+        date_from = request.GET.get('from', '')
         if date_from:
-            date_from = self._to_iso_time(date_from+' 00:00:00')
-            query.append({'field':'timestamp', 'op':'ge', 'value':date_from})
-
+            start = datetime.strptime(date_from+' 00:00:00',
+                                      '%m/%d/%Y %H:%M:%S')
+        date_to = request.GET.get('to', '')
         if date_to:
-            date_to = self._to_iso_time(date_to+" 23:59:59")
-            query.append({'field':'timestamp', 'op':'le', 'value':date_to})
-
-        samples = []
-        meter_type = ""
-        if source and resource:
-            query.append({'field':'resource', 'op':'eq', 'value':resource})
-            sample_list = ceilometer.sample_list(self.request, source, query)
-
-            previous = self._get_previous_val(source, resource, date_from)
-
-            for sample_data in sample_list:
-                current_volume = sample_data.counter_volume
-
-                # if sample is cumulative, substract previous val
-                meter_type = sample_data.counter_type
-                if sample_data.counter_type=="cumulative":
-                    current_delta = current_volume - previous
-                    previous = current_volume
-                    if current_delta<0:
-                        current_delta = current_volume
-                else:
-                    current_delta = current_volume
-                samples.append([sample_data.timestamp[:19], current_delta])
-
-            # if requested period is too long, interpolate data, for cumulative metrics
+            end = datetime.strptime(date_to+' 23:59:59', '%m/%d/%Y %H:%M:%S')
+
+        width = self._get_int(request, 'width', DEFAULT_CHART_WIDTH,
+                              MAX_CHART_SIZE)
+        max_points = self._get_int(request, 'max_points', None)
+        if max_points:
+            # the first and last points are kept, and one in between
+            max_points = max(max_points, 3)
+        decimate = timeseries.DECIMATORS.get(request.GET.get('decimation'),
+                                             timeseries.lttb)
+        return start, end, width, max_points, decimate
+
+    # series chunks of a meter for a resource, as charted
+    # stream: samples are requested as the chunks are consumed instead of
+    # going through the series cache
+    def _chart_series(self, request, source, resource, meter_type, start,
+                      end, width, max_points, decimate, stream=False):
+        query = [{'field':'resource', 'op':'eq', 'value':resource}]
+
+        before = after = []
+        if meter_type and start and end and (end - start).days>=30:
+            # long periods are aggregated by ceilometer, one point
+            # per pixel at most
+            period = chart_period(start, end, width)
+            series = self._period_series(source, query, start, end,
+                                         period, meter_type)
+        else:
+            sample_type, series = self._sample_series(source, resource,
+                                                      query, start, end,
+                                                      stream)
+            if sample_type!="cumulative" and start and end:
+                # add measures of 0 for start and end
+                before = [timeseries.Series([timeseries.to_epoch(start)],
+                                            [0])]
+                after = [timeseries.Series([timeseries.to_epoch(end)], [0])]
+
+        # bound the number of points sent to the chart
+        if max_points:
+            series = [decimate(timeseries.concat(series), max_points)]
+        return itertools.chain(before, series, after)
+
+    # read a positive integer parameter
+    def _get_int(self, request, name, default, maximum=100000):
+        try:
+            return min(max(int(request.GET.get(name, '')), 1), maximum)
+        except ValueError:
+            return default
+
+    # turn samples into series chunks, returns the type of the samples
+    # and the chunks
+    def _sample_series(self, source, resource, query, start, end,
+                       stream=False):
+        if start and end and stream:
+            meter_type, series = ceilometer.sample_chunks(self.request,
+                                                          source, resource,
+                                                          start, end)
+        elif start and end:
+            # served from the series cache when possible
+            meter_type, series = ceilometer.sample_series(self.request,
+                                                          source, resource,
+                                                          start, end)
+            series = [series]
+        else:
+            sample_list = iter(ceilometer.sample_iter(self.request, source,
+                                                      query))
+            first = next(sample_list, None)
+            meter_type = first.counter_type if first else ""
+            if first:
+                sample_list = itertools.chain([first], sample_list)
+            series = timeseries.chunks(sample_list,
+                                       ceilometer.SERIES_CHUNK_SIZE)
             if meter_type=="cumulative":
-                date_start_obj = datetime.strptime(date_from, "%Y-%m-%d %H:%M:%S")
-                date_end_obj = datetime.strptime(date_to, "%Y-%m-%d %H:%M:%S")
-                delta = (date_end_obj - date_start_obj).days
-
-                if delta>=365:
-                    samples = map(to_days, samples)
-                    samples = reduce_metrics(samples)
-                elif delta>=30:
-                    # reduce metrics to hours
-                    samples = map(to_hours, samples)
-                    samples = reduce_metrics(samples)
+                # substract previous val
+                series = timeseries.iter_deltas(series)
+
+        if meter_type=="cumulative" and start and end:
+            # if requested period is too long, interpolate data
+            delta = (end - start).days
+
+            if delta>=365:
+                # reduce metrics to days
+                series = timeseries.iter_buckets(series, 86400)
+            elif delta>=30:
+                # reduce metrics to hours
+                series = timeseries.iter_buckets(series, 3600)
+        return meter_type, series
+
+    # one point per statistics period:
+    # the average increase per sample for cumulative meters,
+    # the sum of delta meters and the average of gauges
+    def _period_series(self, source, query, start, end, period, meter_type):
+        start_ts = timeseries.to_epoch(start)
+        if meter_type=="cumulative":
+            # one more period before start gives the previous volume
+            start -= timedelta(seconds=period)
+        query = query + [
+            {'field':'timestamp', 'op':'ge', 'value':start.isoformat(' ')},
+            {'field':'timestamp', 'op':'le', 'value':end.isoformat(' ')}]
+        statistics = ceilometer.statistic_list(self.request, source, query,
+                                               period=period)
+        statistics.sort(key=operator.attrgetter('period_start'))
+
+        series = timeseries.Series()
+        previous = None
+        for statistic in statistics:
+            timestamp = timeseries.parse_timestamp(statistic.period_start)
+            if meter_type=="cumulative":
+                if timestamp<start_ts:
+                    previous = statistic.max
+                    continue
+                if previous is None:
+                    previous = statistic.min
+                increase = statistic.max - previous
+                if increase<0:
+                    increase = statistic.max
+                previous = statistic.max
+                value = 0
+                if statistic.count:
+                    value = float(increase) / statistic.count
+            elif meter_type=="delta":
+                value = statistic.sum
             else:
-                # add measures of 0 for start and end 
-                samples.append([date_from.replace(" ", "T"), 0])
-                samples.append([date_to.replace(" ", "T"), 0])
+                value = statistic.avg
+            series.append(timestamp, value)
+        return [series]
+
+class BatchSamplesView(SamplesView):
+    """
+    Samples of several (meter, resource) pairs, given as repeated sample,
+    resource and optionally type parameters, fetched concurrently. The
+    series are returned as columns of values aligned on the union of
+    their timestamps, null where a series has no point. A series that
+    failed or was not done within CEILOMETER_BATCH_TIMEOUT seconds of
+    the request has no values and an error instead.
+    """
+    def get(self, request, *args, **kwargs):
+        sources = request.GET.getlist('sample')
+        resources = request.GET.getlist('resource')
+        if len(sources)!=len(resources):
+            return HttpResponseBadRequest('one resource per sample expected')
+        max_series = getattr(settings, 'CEILOMETER_BATCH_MAX_SERIES', 50)
+        if len(sources)>max_series:
+            return HttpResponseBadRequest('at most %d series expected'
+                                          % max_series)
+        types = request.GET.getlist('type')
+        types += [''] * (len(sources) - len(types))
+        params = self._chart_params(request)
+
+        def chart_series(request, source, resource, meter_type):
+            return timeseries.concat(self._chart_series(
+                request, source, resource, meter_type, *params))
+
+        pairs = [(request, source, resource, meter_type) for
+                 source, resource, meter_type in zip(sources, resources,
+                                                     types)]
+        columns = ceilometer.fan_out(
+            chart_series, pairs, default=None,
+            timeout=getattr(settings, 'CEILOMETER_BATCH_TIMEOUT', 120))
+
+        timestamps = sorted(set(itertools.chain.from_iterable(
+            column.timestamps for column in columns if column is not None)))
+        index = dict((timestamp, i) for i, timestamp in
+                     enumerate(timestamps))
+        payload = {
+            'timestamps': [timeseries.format_timestamp(timestamp)
+                           for timestamp in timestamps],
+            'series': [],
+        }
+        for source, resource, column in zip(sources, resources, columns):
+            values, error = None, _("The samples could not be retrieved.")
+            if column is not None:
+                error = None
+                values = [None] * len(timestamps)
+                for timestamp, value in zip(column.timestamps,
+                                            column.values):
+                    values[index[timestamp]] = value
+            payload['series'].append({
+                'sample': source,
+                'resource': resource,
+                'resource_name': ceilometer.resource_name(request, resource),
+                'values': values,
+                'error': error})
+        return gzip(request, HttpResponse(json.dumps(payload),
+                                          content_type='application/json'))
+
+
+class ChartView(SamplesView):
+    """
+    Chart of the same parameters as SamplesView rendered on the server,
+    as pdf (default), png or svg depending on the format parameter, of
+    the height given by the height parameter.
+    """
+    def get(self, request, *args, **kwargs):
+        source = request.GET.get('sample', '')
+        resource = request.GET.get('resource', '')
+        meter_type = request.GET.get('type', '')
+        chart_format = request.GET.get('format', 'pdf')
+        if chart_format not in export.CHART_FORMATS:
+            return HttpResponseBadRequest('unsupported format %s'
+                                          % chart_format)
+
+        start, end, width, max_points, decimate = self._chart_params(request)
+        width = max(width, MIN_CHART_WIDTH)
+        # one point per horizontal unit at most
+        max_points = max_points or width
+        series = timeseries.Series()
+        if source and resource:
+            series = timeseries.concat(self._chart_series(
+                request, source, resource, meter_type, start, end, width,
+                max_points, decimate))
+
+        title = _("%(sample)s for resource %(resource)s "
+                  "(From %(from)s to %(to)s)") % {
+                      'sample': source,
+                      'resource': ceilometer.resource_name(request, resource),
+                      'from': request.GET.get('from', ''),
+                      'to': request.GET.get('to', '')}
+        height = max(self._get_int(request, 'height', DEFAULT_CHART_HEIGHT,
+                                   MAX_CHART_SIZE), MIN_CHART_HEIGHT)
+        content_type, chart = export.render_chart(series, title,
+                                                  chart_format, width, height)
+        response = HttpResponse(chart, content_type=content_type)
+        response["Content-Disposition"] = ("attachment; filename=chart.%s"
+                                           % chart_format)
+        return response
 
-        # output csv
-        headers = ['date', 'value']
-        response = HttpResponse(mimetype='text/csv')
-        writer = csv.writer(response)
-        writer.writerow(headers)
 
-        for sample in samples:
-            writer.writerow(sample)
+class ResourcesView(View):
+    """
+    Page of the resources of a delta or cumulative meter and their
+    names, as JSON, filtered by the prefix parameter and following the
+    marker one.
+    """
+    def get(self, request, *args, **kwargs):
+        meter = request.GET.get('meter', '')
+        resources, more = [], False
+        catalog = ceilometer.meter_catalog(request)
+        if meter in catalog.names(("delta", "cumulative")):
+            limit = getattr(settings, 'API_RESULT_LIMIT', 1000)
+            resources, more = catalog.resources(
+                meter, request.GET.get('prefix', ''),
+                request.GET.get('marker'), limit)
+        directory = ceilometer.resource_directory(request)
+        names = dict((resource_id, directory[resource_id][0])
+                     for resource_id in resources
+                     if directory.get(resource_id, ("",))[0])
+        return HttpResponse(json.dumps({'resources': resources,
+                                        'names': names,
+                                        'more': more}),
+                            content_type='application/json')
 
-        return response
 
 class ExportView(View):
+    """Queue the export of the posted chart to PDF."""
     def post(self, request, *args, **kwargs):
-        data = request.POST.get('svgdata', '')
-
-        # render svg
-        doc = xml.dom.minidom.parseString(data.encode( "utf-8" ))
-        svg = doc.documentElement
-        svgRenderer = SvgRenderer()
-        svgRenderer.render(svg)
-        drawing = svgRenderer.finish()
-
-        # output to pdf
-        pdf = renderPDF.drawToString(drawing)
-        response = HttpResponse(mimetype='application/pdf')
+        # refuse oversized payloads before the form data is read
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return HttpResponseBadRequest('invalid Content-Length')
+        if length > export.max_svg_bytes() * 2:
+            return HttpResponseBadRequest('svgdata too large')
+
+        data = request.POST.get('svgdata', '').encode("utf-8")
+        if not data:
+            return HttpResponseBadRequest('svgdata expected')
+        try:
+            export.validate(data)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        job = export.submit(data)
+        return HttpResponse(json.dumps({'job': job,
+                                        'status': export.status(job)}),
+                            content_type='application/json', status=202)
+
+
+class ExportStatusView(View):
+    def get(self, request, job, *args, **kwargs):
+        job_status = export.status(job)
+        if job_status is None:
+            raise Http404
+        return HttpResponse(json.dumps({'job': job, 'status': job_status}),
+                            content_type='application/json')
+
+
+class ExportDownloadView(View):
+    def get(self, request, job, *args, **kwargs):
+        pdf = export.pdf(job)
+        if pdf is None:
+            raise Http404
+        response = HttpResponse(pdf, mimetype='application/pdf')
         response["Content-Disposition"]= "attachment; filename=chart.pdf"
-        response.write(pdf) 
-
         return response
@@ -0,0 +1,4 @@
+
+
+from ceilometer_horizon.api.timeseries import lttb
+from ceilometer_horizon.api.timeseries import minmax
@@ -14,214 +14,1295 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import bisect
+import calendar
+import collections
+import hashlib
+import inspect
+import itertools
 import logging
+import operator
+import threading
+import time
 import urlparse
 import keystone
+from datetime import datetime, timedelta
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
+from django.core.cache import cache
 from ceilometerclient import client as ceilometer_client
+from ceilometerclient import exc as ceilometer_exc
 
 from horizon import exceptions
 
-from openstack_dashboard.api.base import APIResourceWrapper, APIDictWrapper, url_for
+from openstack_dashboard.api.base import APIDictWrapper, url_for
 from openstack_dashboard.api import keystone
 
+from ceilometer_horizon.api import timeseries
+
 LOG = logging.getLogger(__name__)
 
+# Fields the usage statistics are aggregated on.
+GROUPBY_FIELDS = ['user_id', 'project_id', 'resource_id']
+
+# Whether the Ceilometer API and client support group-by statistics,
+# None until groupby_enabled checks it.
+_groupby_supported = [None]
+
+# Errors of a Ceilometer call fan_out replaces with its default, the
+# other ones are raised.
+API_ERRORS = (ceilometer_exc.BaseException, IOError, TimeoutError)
+
+# Ceilometer clients shared by the requests made with the same token,
+# keyed on (token id, region) and mapped to (client, expiry time), so the
+# endpoint is only looked up in the catalog when a client is created.
+_client_cache = {}
+_client_cache_lock = threading.Lock()
+_client_cache_stats = {'hits': 0, 'misses': 0}
+
+# Seconds after which a usage computation is considered dead and its
+# cache lock may be taken over by another worker.
+USAGE_LOCK_TIMEOUT = 300
+
+IDENTITY_CACHE_KEY = "ceilometer_identity_index"
+
+SERIES_CACHE_KEY = "ceilometer_series:%s"
+
+# Number of samples converted to a time series at once.
+SERIES_CHUNK_SIZE = 10000
 
-class Meter(APIResourceWrapper):
-    _attrs = ['name', 'type', 'unit', 'resource_id', 'user_id',
-              'project_id']
+METER_CATALOG_CACHE_KEY = "ceilometer_meter_catalog"
 
+RESOURCE_DIRECTORY_CACHE_KEY = "ceilometer_resource_directory"
+
+# Usage columns the table filters match, with their Ceilometer query field.
+USAGE_FILTER_COLUMNS = (("tenant", "project"), ("user", "user"),
+                        ("resource", "resource"))
+
+# Row fields each usage filter column matches: resources are shown by
+# name, and may be looked up by id.
+USAGE_INDEX_FIELDS = {"tenant": ("tenant",), "user": ("user",),
+                      "resource": ("resource", "resource_name")}
+
+# Search indexes of the cached usage, {fields: (cache stamp, UsageIndex)}.
+_usage_indexes = {}
+
+
+class Record(object):
+    """
+    Compact copy of the attributes of a ceilometerclient resource.
+    Records hold their attributes in __slots__, without the client
+    object, its info dict or the attribute lookup indirection of
+    APIResourceWrapper; missing attributes are None.
+    """
+    __slots__ = ()
 
-class Resource(APIResourceWrapper):
-    _attrs = ['resource_id', "source", "user_id", "project_id", "metadata"]
+    def __init__(self, apiresource):
+        info = apiresource._info
+        for attr in self.__slots__:
+            setattr(self, attr, info.get(attr))
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__,
+                             dict((attr, getattr(self, attr))
+                                  for attr in self.__slots__))
+
+
+class Meter(Record):
+    __slots__ = ('name', 'type', 'unit', 'resource_id', 'user_id',
+                 'project_id')
+
+
+class Resource(Record):
+    __slots__ = ('resource_id', 'source', 'user_id', 'project_id',
+                 'metadata')
 
     @property
     def name(self):
-        name = self.metadata.get("name", None)
-        display_name = self.metadata.get("display_name", None)
+        metadata = self.metadata or {}
+        name = metadata.get("name", None)
+        display_name = metadata.get("display_name", None)
         return name or display_name or ""
 
 
-class Sample(APIResourceWrapper):
-    _attrs = ['counter_name', 'user_id', 'resource_id', 'timestamp',
-              'resource_metadata', 'source', 'counter_unit', 'counter_volume',
-              'project_id', 'counter_type', 'resource_metadata']
+class Sample(Record):
+    """
+    A sample, without its resource metadata; resource names come from
+    resource_directory.
+    """
+    __slots__ = ('counter_name', 'user_id', 'resource_id', 'timestamp',
+                 'source', 'counter_unit', 'counter_volume', 'project_id',
+                 'counter_type', 'message_id')
 
     @property
     def instance(self):
-        if 'display_name' in self.resource_metadata:
-            return self.resource_metadata['display_name']
-        elif 'instance_id' in self.resource_metadata:
-            return self.resource_metadata['instance_id']
-        else:
-            return None
+        """Name of the resource, or None when it is not known."""
+        return _cached_resource_name(self.resource_id) or None
 
     @property
     def name(self):
-        name = self.resource_metadata.get("name", None)
-        display_name = self.resource_metadata.get("display_name", None)
-        return name or display_name or ""
+        """Name of the resource, or "" when it is not known."""
+        return _cached_resource_name(self.resource_id) or ""
 
 
 class GlobalObjectStoreUsage(APIDictWrapper):
-    _attrs = ["tenant", "user", "resource", "storage_objects",
-              "storage_objects_size", "storage_objects_outgoing_bytes",
+    _attrs = ["tenant", "user", "resource", "resource_name", "project_id",
+              "user_id", "storage_objects", "storage_objects_size",
+              "storage_objects_outgoing_bytes",
               "storage_objects_incoming_bytes"]
 
 
 class GlobalDiskUsage(APIDictWrapper):
-    _attrs = ["tenant", "user", "resource", "disk_read_bytes",
-              "disk_read_requests", "disk_write_bytes",
-              "disk_write_requests"]
+    _attrs = ["tenant", "user", "resource", "resource_name", "project_id",
+              "user_id", "disk_read_bytes", "disk_read_requests",
+              "disk_write_bytes", "disk_write_requests"]
 
 
 class GlobalNetworkTrafficUsage(APIDictWrapper):
-    _attrs = ["tenant", "user", "resource", "network_incoming_bytes",
-              "network_incoming_packets", "network_outgoing_bytes",
-              "network_outgoing_packets"]
+    _attrs = ["tenant", "user", "resource", "resource_name", "project_id",
+              "user_id", "network_incoming_bytes", "network_incoming_packets",
+              "network_outgoing_bytes", "network_outgoing_packets"]
 
 
 class GlobalCpuUsage(APIDictWrapper):
-    _attrs = ["tenant", "user", "resource", "cpu"]
+    _attrs = ["tenant", "user", "resource", "resource_name", "project_id",
+              "user_id", "cpu"]
 
 
 class GlobalNetworkUsage(APIDictWrapper):
-    _attrs = ["tenant", "user", "resource", "network", "network_create",
-              "subnet", "subnet_create", "port", "port_create", "router",
+    _attrs = ["tenant", "user", "resource", "resource_name", "project_id",
+              "user_id", "network", "network_create", "subnet",
+              "subnet_create", "port", "port_create", "router",
               "router_create", "ip_floating", "ip_floating_create"]
 
 
-class Statistic(APIResourceWrapper):
-    _attrs = ['period', 'period_start', 'period_end',
-              'count', 'min', 'max', 'sum', 'avg',
-              'duration', 'duration_start', 'duration_end']
+class GlobalUsageTotals(APIDictWrapper):
+    """Sum of the counters of a usage table over all its rows."""
+    _attrs = ["tenant", "user", "resource"]
+
+
+class Statistic(Record):
+    __slots__ = ('period', 'period_start', 'period_end',
+                 'count', 'min', 'max', 'sum', 'avg',
+                 'duration', 'duration_start', 'duration_end', 'groupby')
+
+
+def _records(record_class, resources, lazy):
+    """
+    Wrap client resources in records. When lazy, the records are yielded
+    one at a time and each client resource is released once wrapped.
+    """
+    if not lazy:
+        return [record_class(r) for r in resources]
+    return _iter_records(record_class, list(resources))
+
+
+def _iter_records(record_class, resources):
+    resources.reverse()
+    while resources:
+        yield record_class(resources.pop())
 
 
 def ceilometerclient(request):
+    """
+    Return a ceilometer client for the token of this request.
+    Clients are cached per token and region until the token expires,
+    which saves creating them and looking their endpoint up. They do not
+    keep connections alive: the HTTP client of ceilometerclient opens a
+    connection per API call.
+    """
+    token = request.user.token
+    key = (token.id, getattr(request.user, 'services_region', None))
+    now = time.time()
+
+    with _client_cache_lock:
+        cached = _client_cache.get(key)
+        if cached and cached[1] > now:
+            _client_cache_stats['hits'] += 1
+            return cached[0]
+        _client_cache_stats['misses'] += 1
+        # Forget the clients of expired tokens.
+        expired = [k for k, v in _client_cache.items() if v[1] <= now]
+        for k in expired:
+            del _client_cache[k]
+
     o = urlparse.urlparse(url_for(request, 'metering'))
     url = "://".join((o.scheme, o.netloc))
     insecure = getattr(settings, 'OPENSTACK_SSL_NO_VERIFY', False)
+    timeout = getattr(settings, 'CEILOMETER_API_TIMEOUT', 30)
     LOG.debug('ceilometerclient connection created using token "%s" '
-              'and url "%s"' % (request.user.token.id, url))
+              'and url "%s"' % (token.id, url))
+
+    client = ceilometer_client.Client('2', url, token=token.id,
+                                      insecure=insecure, timeout=timeout)
+    with _client_cache_lock:
+        _client_cache[key] = (client, _token_expiry(token, now))
+    return client
+
+
+def _token_expiry(token, now):
+    """Time until which a client created with this token may be reused."""
+    expiry = now + getattr(settings, 'CEILOMETER_CLIENT_CACHE_TTL', 3600)
+    expires = getattr(token, 'expires', None)
+    if expires:
+        # utctimetuple() works for both naive (UTC) and aware datetimes.
+        expiry = min(expiry, calendar.timegm(expires.utctimetuple()))
+    return expiry
+
+
+def client_cache_stats():
+    """Return the hit/miss counters and the size of the client cache."""
+    with _client_cache_lock:
+        stats = dict(_client_cache_stats)
+        stats['size'] = len(_client_cache)
+    return stats
+
 
-    return ceilometer_client.Client('2', url, token=request.user.token.id,
-                             insecure=insecure)
+def fan_out(func, args_list, default=None, timeout=None):
+    """
+    Run func once per argument tuple on a bounded thread pool.
+    The results are returned in the order of args_list. A call that
+    fails with one of API_ERRORS, or is not done timeout seconds after
+    fan_out started, CEILOMETER_API_TIMEOUT by default, is logged and
+    replaced by default, any other error is raised. The timeout bounds
+    the whole fan out, not each call.
+    """
+    if not args_list:
+        return []
+    concurrency = getattr(settings, 'CEILOMETER_API_CONCURRENCY', 8)
+    if timeout is None:
+        timeout = getattr(settings, 'CEILOMETER_API_TIMEOUT', 30)
 
+    deadline = time.time() + timeout
+    pool = ThreadPool(max(1, min(concurrency, len(args_list))))
+    try:
+        pending = [pool.apply_async(func, args) for args in args_list]
+        results = []
+        for args, result in zip(args_list, pending):
+            try:
+                results.append(result.get(max(0, deadline - time.time())))
+            except API_ERRORS:
+                LOG.exception('Ceilometer call %s%r failed'
+                              % (func.__name__, args[1:]))
+                results.append(default)
+    finally:
+        # Let the workers exit once they are done, without waiting
+        # for calls that timed out.
+        pool.close()
+    return results
 
-def sample_list(request, meter_name, query=[]):
-    """List the samples for this meters."""
+
+def sample_list(request, meter_name, query=None, lazy=False, limit=None):
+    """
+    List the samples for this meters, at most limit of them, the newest
+    first. When lazy, the samples are yielded instead.
+    """
+    kwargs = {}
+    if limit:
+        kwargs['limit'] = limit
     samples = ceilometerclient(request).samples.list(meter_name=meter_name,
-                                                     q=query)
-    return [Sample(s) for s in samples]
+                                                     q=query or [],
+                                                     **kwargs)
+    return _records(Sample, samples, lazy)
+
+
+def sample_pages(request, meter_name, query=None, end=None, end_op='le'):
+    """
+    Yield the samples of this meter, up to the end datetime, one page at
+    a time from the newest. Pages are CEILOMETER_SAMPLE_PAGE_SIZE samples
+    at most and the timestamp of the oldest sample of a page is the
+    marker the next page ends at; all the samples come in a single page
+    when it is not set. When more samples than a page share a timestamp,
+    only the first page of them can be retrieved and paging goes on
+    before it. Stops when the consumer does.
+    """
+    query = list(query or [])
+    limit = getattr(settings, 'CEILOMETER_SAMPLE_PAGE_SIZE', None)
+    marker = end.isoformat(' ') if end else None
+    marker_op = end_op
+    # number of samples of the marker timestamp already yielded, per key
+    seen = collections.Counter()
+    while True:
+        page_query = query
+        if marker:
+            page_query = query + [{'field': 'timestamp', 'op': marker_op,
+                                   'value': marker}]
+        page = sample_list(request, meter_name, page_query, limit=limit)
+        new = _unseen(page, seen)
+        for sample in new:
+            yield sample
+        if not limit or len(page) < limit:
+            return
+        if not new:
+            LOG.warning('At least %d samples of %s share timestamp %s, '
+                        'only %d of them were retrieved, any other is '
+                        'skipped' % (limit, meter_name, marker,
+                                     sum(seen.values())))
+            seen = collections.Counter()
+            marker_op = 'lt'
+            continue
+        # the next page ends at the oldest timestamp, included since
+        # other samples may share it
+        oldest = min(s.timestamp for s in page)
+        if oldest != marker:
+            seen = collections.Counter()
+        seen.update(_sample_key(s) for s in new if s.timestamp == oldest)
+        marker = oldest
+        marker_op = 'le'
+
+
+def _unseen(page, seen):
+    """
+    The samples of a page not in seen. Samples without message id can
+    not be told apart, as many identical ones as seen are skipped.
+    """
+    remaining = collections.Counter(seen)
+    new = []
+    for sample in page:
+        key = _sample_key(sample)
+        if remaining[key]:
+            remaining[key] -= 1
+        else:
+            new.append(sample)
+    return new
 
-def meter_list(request, query=None):
-    """List the user's meters."""
+
+def _sample_key(sample):
+    return sample.message_id or (sample.timestamp, sample.resource_id,
+                                 sample.counter_volume)
+
+
+def _chronological(samples):
+    """
+    Yield the samples of sample_pages, newest first, from the oldest.
+    Each one is released once yielded.
+    """
+    samples = list(samples)
+    while samples:
+        yield samples.pop()
+
+
+def sample_iter(request, meter_name, query=None, start=None, end=None,
+                start_op='ge', end_op='le'):
+    """
+    Iterate over the samples of this meter in chronological order.
+    The samples between the start and end datetimes are requested at
+    once when the range is at most CEILOMETER_SAMPLE_WINDOW seconds long.
+    Longer ones are requested one window of that many seconds at a time,
+    so only one window of samples is held in memory, and windows are
+    only requested as the consumer goes. start_op and end_op tell
+    whether the bounds themselves are included.
+    """
+    query = list(query or [])
+    if start is not None:
+        query.append({'field': 'timestamp', 'op': start_op,
+                      'value': start.isoformat(' ')})
+    window = getattr(settings, 'CEILOMETER_SAMPLE_WINDOW', 7 * 86400)
+    if start is None or end is None or not window or \
+            end - start <= timedelta(seconds=window):
+        for sample in _chronological(sample_pages(request, meter_name,
+                                                  query, end, end_op)):
+            yield sample
+        return
+
+    window = timedelta(seconds=window)
+    window_query = query
+    window_start = start
+    while window_start <= end:
+        window_end = min(window_start + window, end)
+        # The last window ends at end, the others exclude their end.
+        window_end_op = end_op if window_end == end else 'lt'
+        samples = sample_pages(request, meter_name, window_query,
+                               window_end, window_end_op)
+        for sample in _chronological(samples):
+            yield sample
+        if window_end == end:
+            break
+        window_start = window_end
+        window_query = list(query[:-1]) + [
+            {'field': 'timestamp', 'op': 'ge',
+             'value': window_start.isoformat(' ')}]
+
+
+def sample_series(request, meter_name, resource_id, start, end):
+    """
+    Return the counter type and the timeseries.Series of the samples of
+    this meter for this resource between the start and end datetimes,
+    cumulative volumes being turned into their increase.
+
+    The fetched points are cached per (meter, resource) along with the
+    time range they cover, for CEILOMETER_SERIES_CACHE_TTL seconds. Only
+    the parts of the range the cache lacks are requested: the samples
+    before the cached ones, and those newer than the last cached one.
+    The newer samples continue from the last cached volume.
+    """
+    key = SERIES_CACHE_KEY % hashlib.md5("%s/%s" % (meter_name,
+                                                   resource_id)).hexdigest()
+    query = [{'field': 'resource', 'op': 'eq', 'value': resource_id}]
+    start_ts = timeseries.to_epoch(start)
+    end_ts = timeseries.to_epoch(end)
+
+    entry = cache.get(key)
+    if entry and (end_ts < entry['start'] or start_ts > entry['end']):
+        # disjoint ranges, the cache is of no use
+        entry = None
+
+    if entry is None:
+        entry = _fetch_series(request, meter_name, query, start, end)
+        if entry is None:
+            return None, timeseries.Series()
+        entry['start'] = start_ts
+    else:
+        if start_ts < entry['start']:
+            before = _fetch_series(request, meter_name, query, start,
+                                   timeseries.to_datetime(entry['start']),
+                                   end_op='lt')
+            if before:
+                before['series'].extend(entry['series'])
+                before.update(dict((k, entry[k]) for k in
+                                   ('end', 'marker', 'last_volume')))
+                entry = before
+            entry['start'] = start_ts
+        if end > entry['marker']:
+            after = _fetch_series(request, meter_name, query,
+                                  entry['marker'], end, start_op='gt',
+                                  previous=entry['last_volume'])
+            if after:
+                entry['series'].extend(after['series'])
+                entry.update(dict((k, after[k]) for k in
+                                  ('end', 'marker', 'last_volume')))
+
+    max_points = getattr(settings, 'CEILOMETER_SERIES_CACHE_MAX_POINTS',
+                         100000)
+    if len(entry['series']) <= max_points:
+        cache.set(key, entry,
+                  getattr(settings, 'CEILOMETER_SERIES_CACHE_TTL', 3600))
+    else:
+        cache.delete(key)
+
+    series = entry['series']
+    first = bisect.bisect_left(series.timestamps, start_ts)
+    last = bisect.bisect_right(series.timestamps, end_ts)
+    return entry['type'], series.slice(first, last)
+
+
+def sample_chunks(request, meter_name, resource_id, start, end):
+    """
+    Return the counter type and an iterator over the timeseries.Series
+    chunks of the same samples as sample_series, without its cache: the
+    samples are requested one window at a time as the chunks are
+    consumed, for responses streamed whatever the range.
+    """
+    query = [{'field': 'resource', 'op': 'eq', 'value': resource_id}]
+    return _series_chunks(request, meter_name, query, start, end)
+
+
+def _fetch_series(request, meter_name, query, start, end, start_op='ge',
+                  previous=None, end_op='le'):
+    """
+    Fetch the samples between start and end into a series cache entry,
+    or return None when there is none.
+    """
+    fetched = {}
+    meter_type, chunks = _series_chunks(request, meter_name, query, start,
+                                        end, start_op, previous, end_op,
+                                        fetched)
+    if meter_type is None:
+        return None
+    series = timeseries.concat(chunks)
+    last = fetched['last']
+    return {'type': meter_type,
+            'series': series,
+            'end': series.timestamps[-1],
+            'marker': timeseries.parse_datetime(last.timestamp),
+            'last_volume': last.counter_volume}
+
+
+def _series_chunks(request, meter_name, query, start, end, start_op='ge',
+                   previous=None, end_op='le', fetched=None):
+    """
+    Return the counter type of the samples between start and end, None
+    when there is none, and an iterator over their series chunks,
+    cumulative volumes being turned into their increase. previous is the
+    cumulative volume preceding start. When it is unknown the query
+    starts CEILOMETER_BASELINE_WINDOW seconds earlier, the last sample
+    before start giving it. fetched['last'] is the last sample consumed.
+    """
+    if fetched is None:
+        fetched = {}
+    fetched['previous'] = previous or 0
+    baseline_end = None
+    if previous is None:
+        baseline_end = timeseries.to_epoch(start)
+        start -= timedelta(seconds=getattr(settings,
+                                           'CEILOMETER_BASELINE_WINDOW',
+                                           3600))
+        start_op = 'ge'
+
+    def split_baseline(samples):
+        in_baseline = baseline_end is not None
+        for sample in samples:
+            if in_baseline:
+                if (timeseries.parse_timestamp(sample.timestamp) <
+                        baseline_end):
+                    fetched['previous'] = sample.counter_volume
+                    continue
+                in_baseline = False
+            fetched['last'] = sample
+            yield sample
+
+    samples = split_baseline(sample_iter(request, meter_name, query, start,
+                                         end, start_op, end_op))
+    # the baseline is consumed by the time the first sample comes
+    first = next(samples, None)
+    if first is None:
+        return None, iter(())
+    chunks = timeseries.chunks(itertools.chain([first], samples),
+                               SERIES_CHUNK_SIZE)
+    if first.counter_type == "cumulative":
+        chunks = timeseries.iter_deltas(chunks, fetched['previous'])
+    return first.counter_type, chunks
+
+
+def meter_list(request, query=None, lazy=False):
+    """List the user's meters, or yield them when lazy."""
     meters = ceilometerclient(request).meters.list(q=query)
-    return [Meter(m) for m in meters]
+    return _records(Meter, meters, lazy)
+
+
+def meter_iter(request, query=None):
+    """
+    Yield the user's meters one at a time. The meters API has no limit
+    or marker, the records are only built as the consumer goes.
+    """
+    return meter_list(request, query, lazy=True)
+
+
+class MeterCatalog(object):
+    """
+    The meters indexed by name and type, with the sorted ids of the
+    resources of each meter name for prefix lookups and paging.
+    """
+    def __init__(self, meters):
+        resources = {}
+        self._names = {}
+        for meter in meters:
+            ids = resources.setdefault(meter.name, set())
+            if meter.resource_id:
+                ids.add(meter.resource_id)
+            self._names.setdefault(meter.type, set()).add(meter.name)
+        self._resources = dict((name, sorted(ids))
+                               for name, ids in resources.items())
 
+    def names(self, meter_types):
+        """Names of the meters of these types."""
+        names = set()
+        for meter_type in meter_types:
+            names.update(self._names.get(meter_type, ()))
+        return names
 
-def resource_list(request, query=None):
-    """List the resources."""
+    def resources(self, meter_name, prefix="", marker=None, limit=None):
+        """
+        Return the ids of the resources of a meter starting with prefix,
+        after the marker id, at most limit of them, and whether there
+        are more.
+        """
+        ids = self._resources.get(meter_name, [])
+        start = bisect.bisect_left(ids, prefix)
+        if marker:
+            start = max(start, bisect.bisect_right(ids, marker))
+        page = []
+        for resource_id in itertools.islice(ids, start, None):
+            if not resource_id.startswith(prefix):
+                break
+            if limit is not None and len(page) == limit:
+                return page, True
+            page.append(resource_id)
+        return page, False
+
+
+def meter_catalog(request):
+    """
+    Return the MeterCatalog of all the meters, cached for
+    CEILOMETER_METER_CATALOG_TTL seconds.
+    """
+    catalog = cache.get(METER_CATALOG_CACHE_KEY)
+    if catalog is None:
+        catalog = MeterCatalog(meter_iter(request))
+        cache.set(METER_CATALOG_CACHE_KEY, catalog,
+                  getattr(settings, 'CEILOMETER_METER_CATALOG_TTL', 300))
+    return catalog
+
+
+def resource_list(request, query=None, lazy=False):
+    """List the resources, or yield them when lazy."""
     resources = ceilometerclient(request).\
         resources.list(q=query)
-    return [Resource(r) for r in resources]
+    return _records(Resource, resources, lazy)
+
+
+def resource_directory(request):
+    """
+    Return {resource_id: (display name, instance type)} for all the
+    resources, so names need not come with every sample. The directory
+    is cached for CEILOMETER_RESOURCE_DIRECTORY_TTL seconds.
+    """
+    directory = cache.get(RESOURCE_DIRECTORY_CACHE_KEY)
+    if directory is None:
+        directory = {}
+        for resource in resource_list(request, lazy=True):
+            metadata = resource.metadata or {}
+            directory[resource.resource_id] = (
+                resource.name, metadata.get("instance_type", ""))
+        cache.set(RESOURCE_DIRECTORY_CACHE_KEY, directory,
+                  getattr(settings, 'CEILOMETER_RESOURCE_DIRECTORY_TTL',
+                          300))
+    return directory
+
+
+def _cached_resource_name(resource_id):
+    # records have no request to build the directory with, it is only
+    # read when cached
+    directory = cache.get(RESOURCE_DIRECTORY_CACHE_KEY) or {}
+    return directory.get(resource_id, ("",))[0]
+
+
+def resource_name(request, resource_id):
+    """Display name of a resource, its id when it has none."""
+    entry = resource_directory(request).get(resource_id)
+    return entry and entry[0] or resource_id
 
 
-def statistic_list(request, meter_name, query=[]):
+def statistic_list(request, meter_name, query=None, groupby=None,
+                   period=None, lazy=False):
+    """
+    List the statistics for this meter, or yield them when lazy.
+    When groupby is given, one statistic is returned per distinct
+    combination of the grouped fields. When period is given, one
+    statistic is returned per period of that many seconds.
+    """
+    kwargs = {}
+    if groupby:
+        kwargs['groupby'] = groupby
+    if period:
+        kwargs['period'] = period
     statistics = ceilometerclient(request).\
-        statistics.list(meter_name=meter_name, q=query)
-    return [Statistic(s) for s in statistics]
+        statistics.list(meter_name=meter_name, q=query or [], **kwargs)
+    return _records(Statistic, statistics, lazy)
+
+
+CPU_USAGE_FIELDS = ("cpu",)
+
+OBJECT_STORE_USAGE_FIELDS = ("storage.objects",
+                             "storage.objects.size",
+                             "storage.objects.incoming.bytes",
+                             "storage.objects.outgoing.bytes")
+
+DISK_USAGE_FIELDS = ("disk.read.bytes",
+                     "disk.read.requests",
+                     "disk.write.bytes",
+                     "disk.write.requests")
+
+NETWORK_TRAFFIC_USAGE_FIELDS = ("network.incoming.bytes",
+                                "network.incoming.packets",
+                                "network.outgoing.bytes",
+                                "network.outgoing.packets")
+
+NETWORK_USAGE_FIELDS = ("network", "network_create",
+                        "subnet", "subnet_create",
+                        "port", "port_create",
+                        "router", "router_create",
+                        "ip_floating", "ip_floating_create")
+
+USAGE_FIELD_SETS = (CPU_USAGE_FIELDS, OBJECT_STORE_USAGE_FIELDS,
+                    DISK_USAGE_FIELDS, NETWORK_TRAFFIC_USAGE_FIELDS,
+                    NETWORK_USAGE_FIELDS)
+
+
+def global_cpu_usage(request, marker=None, paginate=False,
+                     filter_string=None):
+    return _wrap_usage(request, CPU_USAGE_FIELDS, GlobalCpuUsage,
+                       marker, paginate, filter_string)
+
+
+def global_object_store_usage(request, marker=None, paginate=False,
+                              filter_string=None):
+    return _wrap_usage(request, OBJECT_STORE_USAGE_FIELDS,
+                       GlobalObjectStoreUsage, marker, paginate,
+                       filter_string)
+
+
+def global_disk_usage(request, marker=None, paginate=False,
+                      filter_string=None):
+    return _wrap_usage(request, DISK_USAGE_FIELDS, GlobalDiskUsage,
+                       marker, paginate, filter_string)
 
 
-def global_cpu_usage(request):
-    result_list = global_usage(request, ["cpu"])
-    return [GlobalCpuUsage(u) for u in result_list]
+def global_network_traffic_usage(request, marker=None, paginate=False,
+                                 filter_string=None):
+    return _wrap_usage(request, NETWORK_TRAFFIC_USAGE_FIELDS,
+                       GlobalNetworkTrafficUsage, marker, paginate,
+                       filter_string)
 
 
-def global_object_store_usage(request):
-    result_list = global_usage(request, ["storage.objects",
-                                         "storage.objects.size",
-                                         "storage.objects.incoming.bytes",
-                                         "storage.objects.outgoing.bytes"])
-    return [GlobalObjectStoreUsage(u) for u in result_list]
+def global_network_usage(request, marker=None, paginate=False,
+                         filter_string=None):
+    return _wrap_usage(request, NETWORK_USAGE_FIELDS, GlobalNetworkUsage,
+                       marker, paginate, filter_string)
 
 
-def global_disk_usage(request):
-    result_list = global_usage(request, ["disk.read.bytes",
-                                         "disk.read.requests",
-                                         "disk.write.bytes",
-                                         "disk.write.requests"])
-    return [GlobalDiskUsage(u) for u in result_list]
+def _wrap_usage(request, fields, wrapper, marker, paginate, filter_string):
+    if paginate:
+        usage, has_more = global_usage(request, fields, marker=marker,
+                                       paginate=True,
+                                       filter_string=filter_string)
+        return [wrapper(u) for u in usage], has_more
+    return [wrapper(u) for u in global_usage(request, fields,
+                                             filter_string=filter_string)]
+
+
+def global_usage(request, fields, marker=None, paginate=False,
+                 filter_string=None):
+    """
+    Return the usage of the given counters for every
+    (tenant, user, resource) tuple, sorted by tenant, user and resource.
+
+    filter_string restricts the rows, see parse_usage_filter.
+    With paginate, only the API_RESULT_PAGE_SIZE rows following the row
+    identified by marker are returned, along with whether more rows
+    follow them.
+    """
+    usage = usage_loader(request).get(fields, filter_string)
+    if not paginate:
+        return usage
+
+    start = 0
+    if marker:
+        for i, row in enumerate(usage):
+            if usage_id(row) == marker:
+                start = i + 1
+                break
+    page_size = getattr(settings, 'API_RESULT_PAGE_SIZE', 20)
+    return usage[start:start + page_size], start + page_size < len(usage)
+
+
+def global_usage_totals(request, fields, filter_string=None):
+    """Return the sum of each counter over all the rows of the usage."""
+    return usage_loader(request).totals(fields, filter_string)
+
+
+def parse_usage_filter(filter_string):
+    """
+    Split a usage filter string into ({column: value}, [terms]).
+    "tenant:", "user:" and "resource:" terms match the start of that
+    column, other terms match any part of the tenant, user or resource.
+    Resources match by name or id.
+    """
+    columns = dict(USAGE_FILTER_COLUMNS)
+    constraints = {}
+    terms = []
+    for term in (filter_string or "").lower().split():
+        column, sep, value = term.partition(":")
+        if sep and column in columns and value:
+            constraints[column] = value
+        else:
+            terms.append(term)
+    return constraints, terms
+
+
+class UsageIndex(object):
+    """
+    Lowercase search index over the tenant, user, resource id and name
+    of usage rows. Each field keeps its distinct values sorted, for
+    prefix lookups, and joined in one string, for substring lookups.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self._fields = {}
+        for field in itertools.chain(*USAGE_INDEX_FIELDS.values()):
+            positions = {}
+            for i, row in enumerate(rows):
+                value = unicode(row.get(field) or "").lower()
+                positions.setdefault(value, []).append(i)
+            values = sorted(positions)
+            offsets = []
+            offset = 0
+            for value in values:
+                offsets.append(offset)
+                offset += len(value) + 1
+            self._fields[field] = (values, [positions[v] for v in values],
+                                   u"\n".join(values), offsets)
+
+    def prefix(self, column, q):
+        """Indices of the rows whose column starts with q."""
+        matches = set()
+        for field in USAGE_INDEX_FIELDS[column]:
+            matches |= self._prefix(field, q)
+        return matches
+
+    def substring(self, column, q):
+        """Indices of the rows whose column contains q."""
+        matches = set()
+        for field in USAGE_INDEX_FIELDS[column]:
+            matches |= self._substring(field, q)
+        return matches
+
+    def _prefix(self, field, q):
+        values, positions, joined, offsets = self._fields[field]
+        matches = set()
+        i = bisect.bisect_left(values, q)
+        while i < len(values) and values[i].startswith(q):
+            matches.update(positions[i])
+            i += 1
+        return matches
+
+    def _substring(self, field, q):
+        values, positions, joined, offsets = self._fields[field]
+        matches = set()
+        found = joined.find(q)
+        while found >= 0:
+            i = bisect.bisect_right(offsets, found) - 1
+            matches.update(positions[i])
+            if i + 1 >= len(offsets):
+                break
+            found = joined.find(q, offsets[i + 1])
+        return matches
+
+    def filter(self, constraints, terms):
+        """Rows matching all the constraints and terms, in row order."""
+        matches = None
+        for column, value in constraints.items():
+            found = self.prefix(column, value)
+            matches = found if matches is None else matches & found
+        for term in terms:
+            found = set()
+            for column, field in USAGE_FILTER_COLUMNS:
+                found |= self.substring(column, term)
+            matches = found if matches is None else matches & found
+        if matches is None:
+            return self.rows
+        return [self.rows[i] for i in sorted(matches)]
+
+
+def usage_id(row):
+    """
+    Identifier of a usage row, also used as pagination marker: its
+    project, user and resource ids. Keystone ids have no "/", the
+    resource id coming last may.
+    """
+    return "%s/%s/%s" % (row['project_id'], row['user_id'],
+                         row['resource'])
+
+
+def usage_loader(request):
+    """Return the UsageLoader of this request, creating it if needed."""
+    loader = getattr(request, '_ceilometer_usage_loader', None)
+    if loader is None:
+        loader = UsageLoader(request)
+        request._ceilometer_usage_loader = loader
+    return loader
+
+
+class UsageLoader(object):
+    """
+    Per-request loader of the global usage tables.
+
+    Field sets can be registered before any of them is read. The first
+    get() then loads every registered set in a single pass: the meters
+    and identity data are fetched once and the statistics of all their
+    fields are requested in one concurrent round.
+
+    Results are shared through Django's cache. Once they are older than
+    CEILOMETER_USAGE_CACHE_TTL the cached table is still returned while
+    a single background thread recomputes it, and concurrent misses on
+    the same fields wait for one computation instead of starting their
+    own.
+    """
+    def __init__(self, request):
+        self.request = request
+        self._field_sets = []
+        self._usage = {}
+        self._stamps = {}
+        self._filtered = {}
+        self._totals = {}
+
+    def register(self, fields):
+        fields = tuple(fields)
+        if fields not in self._field_sets:
+            self._field_sets.append(fields)
+
+    def get(self, fields, filter_string=None):
+        fields = tuple(fields)
+        if filter_string:
+            return self._filter(fields, filter_string)
+        if fields not in self._usage:
+            self.register(fields)
+            self._load()
+        return self._usage[fields]
+
+    def totals(self, fields, filter_string=None):
+        fields = tuple(fields)
+        key = (fields, filter_string or "")
+        if key not in self._totals:
+            totals = dict.fromkeys([f.replace(".", "_") for f in fields], 0)
+            for row in self.get(fields, filter_string):
+                for name in totals:
+                    totals[name] += row.get(name) or 0
+            totals.update({"tenant": "", "user": "", "resource": ""})
+            self._totals[key] = GlobalUsageTotals(totals)
+        return self._totals[key]
+
+    def _filter(self, fields, filter_string):
+        """
+        Filter the usage. When the usage is not loaded, cached or rolled
+        up yet, tenant and user constraints are pushed down to the
+        Ceilometer query if each of them matches a single tenant or user
+        name and can not start the id shown for a tenant or user missing
+        from keystone, which gives the same rows as the index would.
+        Anything else is looked up in the search index of the whole
+        usage.
+        """
+        key = (fields, filter_string)
+        if key in self._filtered:
+            return self._filtered[key]
+
+        constraints, terms = parse_usage_filter(filter_string)
+        query = None
+        if not terms and fields not in self._usage and \
+                not getattr(settings, 'CEILOMETER_USAGE_ROLLUPS', False) and \
+                cache.get(_usage_cache_key(fields)) is None:
+            query = self._filter_query(constraints)
+        if query:
+            usage = _global_usage(self.request, [fields], query)[fields]
+        else:
+            usage = self._index(fields).filter(constraints, terms)
+        self._filtered[key] = usage
+        return usage
+
+    def _filter_query(self, constraints):
+        """
+        Ceilometer query selecting the rows the prefix constraints
+        match, or None when it can not be told without the usage.
+        """
+        if not constraints or "resource" in constraints:
+            # resource ids are only known from the usage itself
+            return None
+        users, tenants = identity_index(self.request)
+        names = {"tenant": tenants, "user": users}
+        ids = {}
+        for column, value in constraints.items():
+            # rows of tenants or users missing from keystone show their
+            # id; a value made of the characters of the known ids may
+            # start one, only the index can tell
+            id_chars = set("".join(names[column]).lower())
+            if set(value) <= id_chars:
+                return None
+            matches = [k for k, v in names[column].items()
+                       if (v or k).lower().startswith(value)]
+            if len(matches) != 1:
+                return None
+            ids[column] = matches[0]
+        return get_query(ids.get("user"), ids.get("tenant"), None)
 
+    def _index(self, fields):
+        usage = self.get(fields)
+        stamp = self._stamps.get(fields)
+        indexed = _usage_indexes.get(fields)
+        if stamp is not None and indexed and indexed[0] == stamp:
+            return indexed[1]
+        index = UsageIndex(usage)
+        if stamp is not None:
+            _usage_indexes[fields] = (stamp, index)
+        return index
 
-def global_network_traffic_usage(request):
-    result_list = global_usage(request, ["network.incoming.bytes",
-                                         "network.incoming.packets",
-                                         "network.outgoing.bytes",
-                                         "network.outgoing.packets"])
-    return [GlobalNetworkTrafficUsage(u) for u in result_list]
+    def _load(self):
+        pending = [f for f in self._field_sets if f not in self._usage]
+        if getattr(settings, 'CEILOMETER_USAGE_ROLLUPS', False):
+            # precomputed by the refresh_usage_rollups command
+            from ceilometer_horizon.admin import rollups
+            entry = rollups.latest_usage(self.request, pending)
+            if entry is not None:
+                stamp, usage = entry
+                for fields in pending:
+                    self._stamps[fields] = stamp
+                    self._usage[fields] = usage[fields]
+                return
 
+        if getattr(settings, 'CEILOMETER_USAGE_CACHE_TTL', 300) <= 0:
+            self._usage.update(_global_usage(self.request, pending))
+            return
 
-def global_network_usage(request):
-    result_list = global_usage(request, ["network", "network_create",
-                                         "subnet", "subnet_create",
-                                         "port", "port_create",
-                                         "router", "router_create",
-                                         "ip_floating", "ip_floating_create"])
-    return [GlobalNetworkUsage(u) for u in result_list]
+        missing = []
+        for fields in pending:
+            entry = _cached_usage(self.request, fields)
+            if entry is None:
+                missing.append(fields)
+            else:
+                self._stamps[fields], self._usage[fields] = entry
 
+        # Compute the sets nobody else is computing, wait for the others.
+        owned = [f for f in missing
+                 if cache.add(_usage_lock_key(f), True, USAGE_LOCK_TIMEOUT)]
+        entries = {}
+        if owned:
+            entries.update(_compute_usage(self.request, owned))
+        for fields in missing:
+            if fields not in entries:
+                entries[fields] = _wait_for_usage(self.request, fields)
+        for fields, (stamp, usage) in entries.items():
+            self._stamps[fields] = stamp
+            self._usage[fields] = usage
 
-def global_usage(request, fields):
-    meters = meter_list(request)
 
-    filtered = filter(lambda m: m.name in fields, meters)
+def _usage_cache_key(fields):
+    digest = hashlib.md5(",".join(sorted(fields))).hexdigest()
+    return "ceilometer_usage:%s" % digest
 
-    def get_query(user, project, resource):
-        query = []
-        if user:
-            query.append({"field": "user", "op": "eq", "value": user})
-        if project:
-            query.append({"field": "project", "op": "eq", "value": project})
-        if resource:
-            query.append({"field": "resource", "op": "eq", "value": resource})
-        return query
+
+def _usage_lock_key(fields):
+    return _usage_cache_key(fields) + ":lock"
+
+
+def _cached_usage(request, fields):
+    """
+    Return the cached (timestamp, usage) of these fields, or None.
+    A stale entry is returned as is and refreshed in the background.
+    """
+    entry = cache.get(_usage_cache_key(fields))
+    if entry is None:
+        return None
+    ttl = getattr(settings, 'CEILOMETER_USAGE_CACHE_TTL', 300)
+    if time.time() - entry[0] > ttl and \
+            cache.add(_usage_lock_key(fields), True, USAGE_LOCK_TIMEOUT):
+        refresh = threading.Thread(target=_refresh_usage,
+                                   args=(request, fields))
+        refresh.daemon = True
+        refresh.start()
+    return entry
+
+
+def _compute_usage(request, field_sets):
+    """
+    Compute and cache the usage of field sets whose locks we hold.
+    Returns {field set: (timestamp, usage)}.
+    """
+    ttl = getattr(settings, 'CEILOMETER_USAGE_CACHE_TTL', 300)
+    stale = getattr(settings, 'CEILOMETER_USAGE_CACHE_STALE', 3600)
+    try:
+        entries = {}
+        for fields, usage in _global_usage(request, field_sets).items():
+            entries[fields] = (time.time(), usage)
+            cache.set(_usage_cache_key(fields), entries[fields], ttl + stale)
+        return entries
+    finally:
+        for fields in field_sets:
+            cache.delete(_usage_lock_key(fields))
+
+
+def _refresh_usage(request, fields):
+    try:
+        _compute_usage(request, [fields])
+    except Exception:
+        LOG.exception('Background refresh of usage %s failed' % (fields,))
+
+
+def _wait_for_usage(request, fields):
+    """
+    Wait for another worker computing this usage to store it.
+    Returns (timestamp, usage).
+    """
+    deadline = time.time() + USAGE_LOCK_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.2)
+        entry = cache.get(_usage_cache_key(fields))
+        if entry is not None:
+            return entry
+        if cache.get(_usage_lock_key(fields)) is None:
+            break
+    return None, _global_usage(request, [fields])[fields]
+
+
+def _global_usage(request, field_sets, query=None):
+    """
+    Collect the usage of each field set for every
+    (tenant, user, resource) tuple matching query, fetching the data
+    of all the sets in one pass. Returns {field set: usage list}.
+    """
+    fields = []
+    for field_set in field_sets:
+        for field in field_set:
+            if field not in fields:
+                fields.append(field)
+
+    if groupby_enabled(request, fields[0]):
+        raw_usage = _grouped_usage_list(request, fields, query)
+    else:
+        raw_usage = _metered_usage_list(request, fields, query)
+    return usage_tables(request, field_sets, raw_usage)
+
+
+def usage_tables(request, field_sets, raw_usage, resource_names=None):
+    """
+    Build the usage of each field set from the total of each
+    (counter, project, user, resource), naming the tenants, users and
+    resources. Resources are named from resource_names, a
+    {resource_id: name} dict, or from the resource directory when it is
+    not given.
+    Returns {field set: usage list}.
+    """
+    users, tenants = identity_index(request)
+    if resource_names is None:
+        resource_names = dict((resource_id, entry[0]) for resource_id, entry
+                              in resource_directory(request).items())
+
+    usage_list = []
+    for usage in raw_usage:
+        project_id = usage['project_id']
+        user_id = usage['user_id']
+        resource_id = usage['resource_id']
+        name = resource_names.get(resource_id)
+        usage_list.append({"tenant": tenants.get(project_id, project_id),
+                           "user": users.get(user_id, user_id),
+                           "project_id": project_id,
+                           "user_id": user_id,
+                           "total": usage['total'],
+                           "counter_name": usage['counter_name'],
+                           "resource": resource_id,
+                           "resource_name": name or resource_id})
+
+    result = {}
+    for field_set in field_sets:
+        names = set(f.replace(".", "_") for f in field_set)
+        # _group_usage updates the rows in place, copy them per set.
+        rows = [dict(u) for u in usage_list if u['counter_name'] in names]
+        result[field_set] = sorted(_group_usage(rows, field_set),
+                                   key=operator.itemgetter('tenant', 'user',
+                                                           'resource'))
+    return result
+
+
+def identity_index(request):
+    """
+    Return ({user_id: user name}, {tenant_id: tenant name}).
+    The index is cached for CEILOMETER_IDENTITY_CACHE_TTL seconds and
+    shared by all the usage tables.
+    """
+    index = cache.get(IDENTITY_CACHE_KEY)
+    if index is None:
+        users = dict((u.id, u.name) for u in keystone.user_list(request))
+        tenants = dict((t.id, t.name)
+                       for t in keystone.tenant_list(request, admin=True))
+        index = (users, tenants)
+        cache.set(IDENTITY_CACHE_KEY, index,
+                  getattr(settings, 'CEILOMETER_IDENTITY_CACHE_TTL', 300))
+    return index
+
+
+def get_query(user, project, resource):
+    query = []
+    if user:
+        query.append({"field": "user", "op": "eq", "value": user})
+    if project:
+        query.append({"field": "project", "op": "eq", "value": project})
+    if resource:
+        query.append({"field": "resource", "op": "eq", "value": resource})
+    return query
+
+
+def groupby_enabled(request, meter_name):
+    """
+    Whether the usage is asked grouped by user, project and resource:
+    CEILOMETER_STATISTICS_GROUPBY is set and the client and API support
+    it. Support is decided once per process, from the arguments of the
+    client and a group-by call of this meter over no sample.
+    """
+    if not getattr(settings, 'CEILOMETER_STATISTICS_GROUPBY', True):
+        return False
+    if _groupby_supported[0] is None:
+        _groupby_supported[0] = _probe_groupby(request, meter_name)
+    # an undecided probe lets the grouped calls fail as any call does
+    return _groupby_supported[0] is not False
+
+
+def _probe_groupby(request, meter_name):
+    """True or False, None when the probe failed for another reason."""
+    argspec = inspect.getargspec(
+        ceilometerclient(request).statistics.list)
+    if 'groupby' not in argspec.args and not argspec.keywords:
+        LOG.warning('The Ceilometer client has no group-by statistics, '
+                    'falling back to one statistics call per meter')
+        return False
+    # no sample is newer than now, only the group-by itself is checked
+    query = [{'field': 'timestamp', 'op': 'gt',
+              'value': datetime.utcnow().isoformat(' ')}]
+    try:
+        statistic_list(request, meter_name, query, groupby=GROUPBY_FIELDS)
+    except ceilometer_exc.HTTPBadRequest:
+        LOG.warning('The Ceilometer API has no group-by statistics, '
+                    'falling back to one statistics call per meter')
+        return False
+    except API_ERRORS:
+        LOG.exception('Group-by statistics support could not be checked')
+        return None
+    return True
+
+
+def _grouped_statistic_list(request, meter_name, query):
+    return statistic_list(request, meter_name, query,
+                          groupby=GROUPBY_FIELDS)
+
+
+def _grouped_usage_list(request, fields, query=None):
+    """
+    Ask for the statistics of each counter once, grouped by user,
+    project and resource, so the number of API calls only depends
+    on the number of fields. See groupby_enabled.
+    """
+    calls = [(request, field, query or []) for field in fields]
+    results = fan_out(_grouped_statistic_list, calls, default=[])
+
+    usage_list = []
+    for field, statistics in zip(fields, results):
+        for statistic in statistics:
+            group = getattr(statistic, 'groupby', None) or {}
+            usage_list.append({"project_id": group.get('project_id'),
+                               "user_id": group.get('user_id'),
+                               "resource_id": group.get('resource_id'),
+                               "total": statistic.max,
+                               "counter_name": field.replace(".", "_")})
+    return usage_list
+
+
+def _metered_usage_list(request, fields, query=None):
+    """
+    Fallback for Ceilometer APIs without group-by support:
+    one statistics call per (meter, user, project, resource).
+    """
+    filtered = [m for m in meter_iter(request, query=query)
+                if m.name in fields]
+
+    calls = [(request, m.name, get_query(m.user_id, m.project_id,
+                                         m.resource_id))
+             for m in filtered]
+    results = fan_out(statistic_list, calls, default=[])
 
     usage_list = []
-    ks_user_list = keystone.user_list(request)
-    ks_tenant_list = keystone.tenant_list(request, admin=True)
-
-    def get_user(user_id):
-        for u in ks_user_list:
-            if u.id == user_id:
-                return u.name
-        return user_id
-
-    def get_tenant(tenant_id):
-        for t in ks_tenant_list:
-            if t.id == tenant_id:
-                return t.name
-        return tenant_id
-
-    for m in filtered:
-        statistics = statistic_list(request, m.name,
-                                    query=get_query(m.user_id,
-                                                    m.project_id,
-                                                    m.resource_id))
-        # TODO: It seems that there's only one element in statistic list.
-        # TODO: if statistics is []
-        statistic = statistics[0]
-
-        usage_list.append({"tenant": get_tenant(m.project_id),
-                          "user": get_user(m.user_id),
-                          "total": statistic.max,
-                          "counter_name": m.name.replace(".", "_"),
-                          "resource": m.resource_id})
-    return _group_usage(usage_list, fields)
-
-
-def _group_usage(usage_list, fields=[]):
+    for m, statistics in zip(filtered, results):
+        # Statistics without groupby hold a single element; a failed
+        # or empty call counts as no usage.
+        total = statistics[0].max if statistics else 0
+
+        usage_list.append({"project_id": m.project_id,
+                           "user_id": m.user_id,
+                           "total": total,
+                           "counter_name": m.name.replace(".", "_"),
+                           "resource_id": m.resource_id})
+    return usage_list
+
+
+def _group_usage(usage_list, fields=()):
     """
     Group usage data of different counters to one object.
     The usage data in one group have the same resource,
@@ -230,7 +1311,7 @@ def _group_usage(usage_list, fields=[]):
     fields = [f.replace(".", "_") for f in fields]
     result = {}
     for s in usage_list:
-        key = "%s_%s_%s" % (s['user'], s['tenant'], s['resource'])
+        key = (s['project_id'], s['user_id'], s['resource'])
         if key not in result:
             result[key] = s
         # Make sure each object contains the fields that may not
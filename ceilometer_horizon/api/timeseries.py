@@ -0,0 +1,309 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Compact time series of samples: epoch-second timestamps and float
+values held in two parallel arrays.
+"""
+
+import bisect
+import calendar
+import itertools
+import struct
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+
+REDUCERS = {
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'avg': lambda values: sum(values) / len(values),
+    'last': lambda values: values[-1],
+}
+
+# Epoch seconds of the days already parsed, keyed by "YYYY-MM-DD".
+_days = {}
+
+
+def parse_timestamp(timestamp):
+    """Epoch seconds of an ISO 8601 timestamp, ignoring fractions."""
+    day = timestamp[:10]
+    seconds = _days.get(day)
+    if seconds is None:
+        seconds = calendar.timegm((int(day[:4]), int(day[5:7]),
+                                   int(day[8:10]), 0, 0, 0))
+        _days[day] = seconds
+    return (seconds + int(timestamp[11:13]) * 3600 +
+            int(timestamp[14:16]) * 60 + int(timestamp[17:19]))
+
+
+def parse_datetime(timestamp):
+    """Naive datetime of an ISO 8601 timestamp, fractions included."""
+    timestamp = timestamp.replace("T", " ")[:26]
+    if "." in timestamp:
+        return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
+    return datetime.strptime(timestamp[:19], "%Y-%m-%d %H:%M:%S")
+
+
+def format_timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+
+
+def to_epoch(date):
+    """Epoch seconds of a naive UTC datetime."""
+    return calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+
+
+def to_datetime(seconds):
+    """Naive UTC datetime of epoch seconds."""
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds)
+
+
+class Series(object):
+    """Time series sorted by timestamp."""
+    def __init__(self, timestamps=(), values=()):
+        self.timestamps = array('d', timestamps)
+        self.values = array('d', values)
+
+    @classmethod
+    def from_samples(cls, samples):
+        series = cls()
+        timestamps = series.timestamps
+        values = series.values
+        for sample in samples:
+            timestamps.append(parse_timestamp(sample.timestamp))
+            values.append(sample.counter_volume)
+        return series
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def slice(self, start=None, stop=None):
+        return Series(self.timestamps[start:stop], self.values[start:stop])
+
+    def append(self, timestamp, value):
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def extend(self, other):
+        self.timestamps.extend(other.timestamps)
+        self.values.extend(other.values)
+
+    def deltas(self, previous=0):
+        """
+        Turn cumulative values into their increase since the previous
+        value. A decrease is a counter reset, the increase is then the
+        value itself. previous is the value preceding the series.
+        Returns the series of increases and its last cumulative value.
+        """
+        values = self.values
+        if not values:
+            return Series(), previous
+        before = array('d', [previous])
+        before.extend(values[:-1])
+        increases = array('d', [v - p if v >= p else v
+                                for v, p in zip(values, before)])
+        return Series(self.timestamps, increases), values[-1]
+
+    def bucket(self, width, reducer='avg'):
+        """
+        Reduce the values falling in the same width seconds bucket with
+        one of REDUCERS. Buckets are timestamped by their start.
+        """
+        reduce_values = REDUCERS[reducer]
+        keys = [int(t // width) for t in self.timestamps]
+        result = Series()
+        start = 0
+        for key, group in itertools.groupby(keys):
+            stop = start + sum(1 for _ in group)
+            result.timestamps.append(key * width)
+            result.values.append(reduce_values(self.values[start:stop]))
+            start = stop
+        return result
+
+    def compact(self):
+        """
+        Columnar form of the series: the first timestamp, the seconds
+        elapsed since the previous point and the values.
+        """
+        timestamps = [int(t) for t in self.timestamps]
+        start = timestamps[0] if timestamps else 0
+        return {'start': start,
+                'deltas': [t - p for t, p in
+                           zip(timestamps, [start] + timestamps[:-1])],
+                'values': self.values.tolist()}
+
+    def pack(self):
+        """
+        Binary form of compact(), little-endian: the point count as an
+        unsigned 32 bits integer, the start as a 64 bits float, then the
+        deltas as signed 32 bits integers and the values as 64 bits
+        floats.
+        """
+        compact = self.compact()
+        deltas = array('i', compact['deltas'])
+        values = array('d', self.values)
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+            values.byteswap()
+        return (struct.pack('<Id', len(values), compact['start']) +
+                _to_bytes(deltas) + _to_bytes(values))
+
+    def rows(self):
+        """Yield [ISO 8601 timestamp, value] rows."""
+        for timestamp, value in zip(self.timestamps, self.values):
+            yield [format_timestamp(timestamp), value]
+
+
+def _to_bytes(values):
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def concat(chunks):
+    """Join consecutive chunks of a series into one Series."""
+    series = Series()
+    for chunk in chunks:
+        series.extend(chunk)
+    return series
+
+
+def lttb(series, max_points):
+    """
+    Downsample a series to max_points with the Largest-Triangle-Three-
+    Buckets algorithm, which keeps the points shaping the curve. The
+    first and last points are always kept, they are all that is left
+    below 3 points.
+    """
+    count = len(series)
+    if max_points >= count:
+        return series
+    if max_points < 3:
+        return _ends(series, max_points)
+    timestamps = series.timestamps
+    values = series.values
+    result = Series()
+    result.append(timestamps[0], values[0])
+
+    # the points between the first and the last are split in
+    # max_points - 2 buckets, one point is kept per bucket
+    every = float(count - 2) / (max_points - 2)
+    kept = 0
+    for i in range(max_points - 2):
+        # average point of the next bucket
+        next_start = int((i + 1) * every) + 1
+        next_stop = min(int((i + 2) * every) + 1, count)
+        next_count = next_stop - next_start
+        avg_t = sum(timestamps[next_start:next_stop]) / next_count
+        avg_v = sum(values[next_start:next_stop]) / next_count
+
+        # point of this bucket forming the largest triangle with the
+        # last kept point and the average of the next bucket
+        kept_t = timestamps[kept]
+        kept_v = values[kept]
+        largest = -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((kept_t - avg_t) * (values[j] - kept_v) -
+                       (kept_t - timestamps[j]) * (avg_v - kept_v))
+            if area > largest:
+                largest = area
+                selected = j
+        result.append(timestamps[selected], values[selected])
+        kept = selected
+
+    result.append(timestamps[-1], values[-1])
+    return result
+
+
+def minmax(series, max_points):
+    """
+    Downsample a series to at most max_points by keeping the lowest and
+    the highest point of max_points / 2 buckets, in time order.
+    """
+    count = len(series)
+    buckets = max_points // 2
+    if max_points >= count:
+        return series
+    if buckets < 1:
+        return _ends(series, max_points)
+    timestamps = series.timestamps
+    values = series.values
+    result = Series()
+    every = float(count) / buckets
+    for i in range(buckets):
+        start = int(i * every)
+        stop = int((i + 1) * every)
+        indices = range(start, stop)
+        low = min(indices, key=values.__getitem__)
+        high = max(indices, key=values.__getitem__)
+        for j in sorted(set((low, high))):
+            result.append(timestamps[j], values[j])
+    return result
+
+
+def _ends(series, max_points):
+    """The first and the last points of a series, max_points of them."""
+    ends = Series()
+    for i in (0, len(series) - 1)[:max(max_points, 0)]:
+        ends.append(series.timestamps[i], series.values[i])
+    return ends
+
+
+DECIMATORS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+
+def chunks(samples, size):
+    """Yield a Series per size consecutive samples."""
+    samples = iter(samples)
+    while True:
+        series = Series.from_samples(itertools.islice(samples, size))
+        if not series:
+            return
+        yield series
+
+
+def iter_deltas(chunks, previous=0):
+    """Series.deltas over consecutive chunks of a cumulative series."""
+    for chunk in chunks:
+        increases, previous = chunk.deltas(previous)
+        yield increases
+
+
+def iter_buckets(chunks, width, reducer='avg'):
+    """
+    Series.bucket over consecutive chunks of a series. The values of a
+    bucket spanning several chunks are reduced together.
+    """
+    pending = Series()
+    for chunk in chunks:
+        pending.extend(chunk)
+        if not pending:
+            continue
+        # the last bucket may go on in the next chunk
+        last_start = (pending.timestamps[-1] // width) * width
+        cut = bisect.bisect_left(pending.timestamps, last_start)
+        if cut:
+            yield pending.slice(0, cut).bucket(width, reducer)
+            pending = pending.slice(cut)
+    if pending:
+        yield pending.bucket(width, reducer)